@@ -15,6 +15,7 @@
 """Asynchronous Python driver for MongoDB."""
 
 from apymongo.connection import Connection as APyMongo_Connection
+from apymongo.read_preferences import ReadPreference
 
 ASCENDING = 1
 """Ascending sort order."""
@@ -18,6 +18,7 @@ import warnings
 import functools
 
 from bson.code import Code
+from bson.objectid import ObjectId
 from bson.son import SON
 from apymongo import (helpers,
                      message)
@@ -27,6 +28,36 @@ from apymongo.errors import InvalidName
 _ZERO = "\x00\x00\x00\x00"
 
 
+def _pop_network_timeout(kwargs):
+    """Take `network_timeout` out of `kwargs` (which otherwise hold
+    getLastError options), returning it in a form that can be passed on
+    as keyword arguments.
+    """
+    if "network_timeout" in kwargs:
+        return {"network_timeout": kwargs.pop("network_timeout")}
+    return {}
+
+
+def _split_points(lowest, highest, n):
+    """Values splitting ``[lowest, highest]`` into `n` roughly even
+    ranges: by generation time for :class:`~bson.objectid.ObjectId` s,
+    by value for numbers. Anything else isn't split.
+    """
+    if isinstance(lowest, ObjectId) and isinstance(highest, ObjectId):
+        start = lowest.generation_time
+        step = (highest.generation_time - start) / n
+        points = [ObjectId.from_datetime(start + step * i)
+                  for i in range(1, n)]
+    elif (isinstance(lowest, (int, long, float)) and
+          isinstance(highest, (int, long, float)) and
+          not isinstance(lowest, bool) and not isinstance(highest, bool)):
+        points = [lowest + (highest - lowest) * i / n for i in range(1, n)]
+    else:
+        return []
+    # Ranges too narrow to split come out as repeats.
+    return sorted(set(point for point in points if lowest < point <= highest))
+
+
 def _gen_index_name(keys):
     """Generate an index name from the set of fields it is over.
     """
@@ -271,19 +302,30 @@ class Collection(object):
         if manipulate:
             docs = [self.__database._fix_incoming(doc, self) for doc in docs]
 
+        timeout = _pop_network_timeout(kwargs)
         if kwargs:
             safe = True
             
         if callback:
             def mod_callback(result):
+                if isinstance(result, Exception):
+                    callback(result)
+                    return
                 ids = [doc.get("_id", None) for doc in docs]
                 callback(return_one and ids[0] or ids)
         else:
             mod_callback = None
                
-        self.__database.connection._send_message(
-            message.insert(self.__full_name, docs,
-                           check_keys, safe, kwargs), with_last_error=safe,callback=mod_callback)
+        connection = self.__database.connection
+        if connection._supports_op_msg():
+            build = message.insert_op_msg
+        else:
+            build = message.insert
+        connection._send_message(
+            connection._encode(build, self.__full_name, docs,
+                               check_keys, safe, kwargs), with_last_error=safe,callback=mod_callback,
+            _op_type="insert",
+            **timeout)
 
 
     def update(self, spec, document, upsert=False, manipulate=False,
@@ -369,12 +411,20 @@ class Collection(object):
         if upsert and manipulate:
             document = self.__database._fix_incoming(document, self)
 
+        timeout = _pop_network_timeout(kwargs)
         if kwargs:
             safe = True
 
-        self.__database.connection._send_message(
-            message.update(self.__full_name, upsert, multi,
-                           spec, document, safe, kwargs), with_last_error = safe, callback=callback)
+        connection = self.__database.connection
+        if connection._supports_op_msg():
+            build = message.update_op_msg
+        else:
+            build = message.update
+        connection._send_message(
+            connection._encode(build, self.__full_name, upsert, multi,
+                               spec, document, safe, kwargs), with_last_error = safe, callback=callback,
+            _op_type="update",
+            **timeout)
 
     def drop(self):
         """Alias for :meth:`~pymongo.database.Database.drop_collection`.
@@ -443,11 +493,20 @@ class Collection(object):
         if not isinstance(spec_or_id, dict):
             spec_or_id = {"_id": spec_or_id}
 
+        timeout = _pop_network_timeout(kwargs)
         if kwargs:
             safe = True
 
-        self.__database.connection._send_message(
-            message.delete(self.__full_name, spec_or_id, safe, kwargs), with_last_error=safe,callback=callback)
+        connection = self.__database.connection
+        if connection._supports_op_msg():
+            build = message.delete_op_msg
+        else:
+            build = message.delete
+        connection._send_message(
+            connection._encode(build, self.__full_name, spec_or_id,
+                               safe, kwargs), with_last_error=safe,callback=callback,
+            _op_type="delete",
+            **timeout)
 
     def find_one(self, spec_or_id = None, callback=None,  *args, **kwargs):
         """Get a single document from the database.
@@ -549,6 +608,24 @@ class Collection(object):
           - `as_class` (optional): class to use for documents in the
             query result (default is
             :attr:`~pymongo.connection.Connection.document_class`)
+          - `read_preference` (optional): which member of a replica set
+            to read from (see
+            :class:`~apymongo.read_preferences.ReadPreference`; default is
+            :attr:`~apymongo.connection.Connection.read_preference`)
+          - `prefetch` (optional): if True, ask for each batch of
+            results as soon as the one before it arrives, so that the
+            server fetches it while that one is being processed
+          - `target_batch_bytes` (optional): size each batch after the
+            first so that it holds about this many bytes, going by the
+            size of the documents seen so far
+          - `target_batch_time` (optional): size each batch after the
+            first so that it takes about this many seconds to process
+            (or, with :meth:`~apymongo.cursor.Cursor.batches`, until
+            the consumer asks for the next)
+          - `exhaust` (optional): if True, the server streams every
+            batch back on a stream of its own without waiting to be
+            asked for each. The batches keep coming whether or not
+            :meth:`~apymongo.cursor.Cursor.batches` is ready for them
           - `network_timeout` (optional): specify a timeout to use for
             this query, which will override the
             :class:`~pymongo.connection.Connection`-level default
@@ -573,6 +650,125 @@ class Collection(object):
         """
         return Cursor(self, *args, **kwargs)
 
+    def parallel_find(self, spec=None, n=4, callback=None, key="_id",
+                      split_points=None, **kwargs):
+        """Scan the documents matching `spec` with `n` cursors at once,
+        each over its own range of `key`, which should be indexed.
+
+        The ranges are split at `split_points` (sorted values of `key`,
+        one fewer than the ranges wanted) if given. Otherwise the
+        smallest and largest values of `key` are looked up and the
+        range between them split evenly: by generation time for
+        :class:`~bson.objectid.ObjectId` s (the usual ``"_id"``), or by
+        value for numbers. Values of any other type aren't split, and
+        the scan is done by a single cursor. Documents whose `key` is of
+        another type than the split points are missed.
+
+        Batches are passed to ``callback(batch, more)`` as they arrive
+        from any of the cursors, as with
+        :meth:`~apymongo.cursor.Cursor.batches`: calling `more` lets the
+        cursor that batch came from fetch its next one. Once every
+        cursor is exhausted `callback` is called with ``(None, None)``.
+        The first error is passed instead of a batch, after which
+        nothing more is.
+
+        :Parameters:
+          - `spec` (optional): a SON object specifying elements which
+            must be present for a document to be included in the
+            result set
+          - `n` (optional): the number of cursors to scan with
+          - `callback`: function taking ``(batch, more)``
+          - `key` (optional): the field to split the scan on
+          - `split_points` (optional): values of `key` to split the scan
+            at, instead of `n` even ranges
+          - `**kwargs` (optional): any additional keyword arguments
+            are the same as the arguments to :meth:`find`, except
+            `skip`, `limit`, `sort` and `tailable`, which would apply to
+            each range separately. `read_preference` and
+            `network_timeout` apply to looking up the split points too
+        """
+        if spec is None:
+            spec = {}
+        if not isinstance(spec, dict):
+            raise TypeError("spec must be an instance of dict")
+        if not isinstance(n, int) or n < 1:
+            raise ValueError("n must be a positive int")
+        if not callable(callback):
+            raise TypeError("callback must be callable")
+        for name in ("skip", "limit", "sort", "tailable"):
+            if name in kwargs:
+                raise TypeError("parallel_find doesn't take %s" % name)
+
+        def scan(points):
+            if isinstance(points, Exception):
+                callback(points, None)
+                return
+
+            bounds = zip([None] + points, points + [None])
+            state = {"left": len(bounds), "failed": False}
+
+            def on_batch(batch, more):
+                if state["failed"]:
+                    return
+                if isinstance(batch, Exception):
+                    state["failed"] = True
+                    callback(batch, None)
+                elif batch is not None:
+                    callback(batch, more)
+                else:
+                    state["left"] -= 1
+                    if not state["left"]:
+                        callback(None, None)
+
+            for (lower, upper) in bounds:
+                condition = SON()
+                if lower is not None:
+                    condition["$gte"] = lower
+                if upper is not None:
+                    condition["$lt"] = upper
+                if not condition:
+                    range_spec = spec
+                elif key in spec:
+                    range_spec = {"$and": [spec, {key: condition}]}
+                else:
+                    range_spec = SON(spec)
+                    range_spec[key] = condition
+                self.find(spec=range_spec, **kwargs).batches(on_batch)
+
+        if split_points is not None:
+            scan(list(split_points))
+        elif n == 1:
+            scan([])
+        else:
+            options = dict((name, kwargs[name])
+                           for name in ("read_preference", "network_timeout")
+                           if name in kwargs)
+            self.__split(spec, key, n, scan, **options)
+
+    def __split(self, spec, key, n, callback, **kwargs):
+        """Pass `n` - 1 points evenly splitting the values of `key` among
+        the documents matching `spec` to `callback`.
+
+        `kwargs` are passed on to the queries for the smallest and
+        largest values.
+        """
+        ends = {}
+
+        def on_end(direction, document):
+            if "error" in ends:
+                return
+            if isinstance(document, Exception):
+                ends["error"] = document
+                callback(document)
+                return
+            ends[direction] = document and document.get(key)
+            if len(ends) == 2:
+                callback(_split_points(ends[1], ends[-1], n))
+
+        for direction in (1, -1):
+            self.find_one(spec, functools.partial(on_end, direction),
+                          fields=[key], sort=[(key, direction)], **kwargs)
+
 
     def count(self,callback):
         """Get the number of documents in this collection.
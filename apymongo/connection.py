@@ -35,30 +35,89 @@ access:
 
 import datetime
 import os
+import random
+import collections
 import select
 import struct
 import socket
-import threading
 import time
+import urllib
 import warnings
+import weakref
+import zlib
 import functools
 
+import tornado.ioloop
 import tornado.iostream
 
+from bson.son import SON
 from apymongo import (database,
                      helpers,
-                     message)
+                     message,
+                     read_preferences)
 from apymongo.cursor_manager import CursorManager
+from apymongo.message import OP_MSG
+from apymongo.metrics import (Metrics,
+                              _Histogram,
+                              _op_type)
+from apymongo.monitoring import (OperationEvent,
+                                 _namespace)
+from apymongo.read_preferences import ReadPreference
 from apymongo.errors import (AutoReconnect,
                             ConfigurationError,
                             ConnectionFailure,
                             DuplicateKeyError,
                             InvalidURI,
-                            OperationFailure)
+                            NetworkTimeout,
+                            OperationFailure,
+                            OverloadedError,
+                            TimeoutError)
 
 
 _CONNECT_TIMEOUT = 20.0
 
+# messageLength, requestID, responseTo, opCode
+_HEADER = struct.Struct("<iiii")
+
+# responseFlags, cursorID: the start of an OP_REPLY body
+_REPLY_START = struct.Struct("<iq")
+
+# Bounds on the delay before looking for a primary again, in seconds. The
+# actual delay is picked at random below the (doubling) bound so that many
+# clients that lost the same primary don't all come back at once.
+_RECONNECT_BACKOFF_MIN = 0.05
+_RECONNECT_BACKOFF_MAX = 5.0
+
+# Reads of a collection aren't hedged until this many have been timed, so
+# that the threshold means something.
+_HEDGE_MIN_SAMPLES = 20
+
+
+def _more_to_come(body):
+    """Will the server follow the OP_REPLY `body`, to an exhaust query,
+    with another? It does until the cursor is exhausted or the query
+    fails.
+    """
+    (flags, cursor_id) = _REPLY_START.unpack_from(body)
+    return bool(cursor_id) and not flags & 3
+
+
+def _deadline(started, timeout):
+    """When an operation started at `started` times out, or ``None`` if
+    its `timeout` is ``None``.
+    """
+    if timeout is None:
+        return None
+    return started + timeout
+
+
+def _remaining(deadline):
+    """Seconds left until `deadline` (``None`` if there is none).
+    """
+    if deadline is None:
+        return None
+    return max(deadline - time.time(), 0)
+
 
 def _partition(source, sub):
     """Our own string partitioning method.
@@ -75,7 +134,14 @@ def _str_to_node(string, default_port=27017):
     """Convert a string to a node tuple.
 
     "localhost:27017" -> ("localhost", 27017)
+
+    Unix domain sockets (whose paths must end in ".sock" and may be
+    percent-encoded) have no port:
+
+    "/tmp/mongodb-27017.sock" -> ("/tmp/mongodb-27017.sock", None)
     """
+    if string.endswith(".sock"):
+        return (urllib.unquote(string), None)
     (host, port) = _partition(string, ":")
     if port:
         port = int(port)
@@ -84,8 +150,21 @@ def _str_to_node(string, default_port=27017):
     return (host, port)
 
 
+def _node_to_str(node):
+    (host, port) = node
+    if port is None:
+        return host
+    return "%s:%d" % node
+
+
 def _parse_uri(uri, default_port=27017):
     """MongoDB URI parser.
+
+    Besides hosts, a URI can name a Unix domain socket, either
+    percent-encoded (``mongodb://%2Ftmp%2Fmongodb-27017.sock/db``) or as
+    a bare path (``mongodb:///tmp/mongodb-27017.sock/db``). A bare path
+    has to be the only host, without credentials, and end at its first
+    ``.sock``; anything else has to be percent-encoded.
     """
 
     if uri.startswith("mongodb://"):
@@ -93,7 +172,24 @@ def _parse_uri(uri, default_port=27017):
     elif "://" in uri:
         raise InvalidURI("Invalid uri scheme: %s" % _partition(uri, "://")[0])
 
-    (hosts, namespace) = _partition(uri, "/")
+    if uri.startswith("/"):
+        end = uri.find(".sock")
+        if end < 0:
+            raise InvalidURI("unix domain socket paths must end in .sock")
+        end += len(".sock")
+        (hosts, namespace) = (uri[:end], uri[end + 1:])
+        if uri[end:end + 1] not in ("", "/", "?") or "," in hosts:
+            raise InvalidURI("percent-encode unix domain socket paths "
+                             "that don't end at their first .sock, or "
+                             "list several sockets")
+        if "/" in _partition(namespace, "?")[0]:
+            raise InvalidURI("percent-encode unix domain socket paths "
+                             "with more than one .sock in them")
+    else:
+        (hosts, namespace) = _partition(uri, "/")
+        if hosts.endswith("@"):
+            raise InvalidURI("percent-encode a unix domain socket path "
+                             "given with credentials")
 
     raw_options = None
     if namespace:
@@ -139,83 +235,660 @@ def _parse_uri(uri, default_port=27017):
 
     return (host_list, db, username, password, collection, options)
 
-             
-def receive_body_on_stream(operation,request_id,strm,callback,header):
-                            
-        length = struct.unpack("<i", header[:4])[0]
-        assert request_id == struct.unpack("<i", header[8:12])[0], \
-            "ids don't match %r %r" % (request_id,
-                                       struct.unpack("<i", header[8:12])[0])
-        assert operation == struct.unpack("<i", header[12:])[0]
-
-        strm.read_bytes(length-16,callback)
-        
 
-class _Pool(threading.local):
-    """A simple connection pool.
+class _Channel(object):
+    """An IOStream plus the bookkeeping needed to route replies on it.
+
+    Replies are matched to requests by the ``responseTo`` field of the
+    reply header rather than by the order in which they arrive, so any
+    number of requests can be written to the stream back to back while a
+    single read loop hands each reply to the callback that is waiting
+    for it.
+
+    A request that isn't answered within its timeout fails with
+    :class:`~apymongo.errors.NetworkTimeout` and the channel is
+    quarantined: it reports itself closed so it isn't handed out again,
+    and is closed for real once nothing else is waiting on it.
+
+    Messages that expect no reply can be queued with :meth:`write_later`
+    so that many of them go out in a single write (at the latest, when
+    the channel is closed).
 
-    Uses thread-local stream per thread. By calling return_stream() a
-    thread can return a stream to the pool. Right now the pool size is
-    capped at 10 streams - we can expose this as a parameter later, if
-    needed.
+    For an exhaust query the server streams every batch back unasked,
+    each in reply to (``responseTo``) the one before it, so the callback
+    is moved along to each reply's own ``requestID`` until the last.
     """
 
-    # Non thread-locals
-    __slots__ = ["streams", "stream_factory", "pool_size", "pid"]
+    def __init__(self, stream):
+        self.stream = stream
+        self.pending = {}
+        self.deadlines = {}
+        self.exhausting = {}
+        self.quarantined = False
+        self.closing = False
+        self.reading = False
+        self.connected = False
+        self.address = None
+        self.pool = None
+        self.pid = None
+        self.dedicated = False
+        self.authset = set()
+        self.authenticating = None
+        self.compression = None
+        self.metrics = None
+        self.checkout_wait = None
+        self.created = self.last_used = time.time()
+        self.__connect_callback = None
+        self.__outgoing = []
+        self.__outgoing_bytes = 0
+        stream.set_close_callback(self.__on_close)
+
+    def connect(self, address, callback, timeout=None):
+        """Connect the stream to `address` and pass this channel (or the
+        error if the connection could not be made within `timeout`
+        seconds) to `callback`.
+        """
+        self.__connect_callback = callback
+        self.address = address
 
-    # thread-local default
-    stream = None
+        (host, port) = address
+        if port is None:
+            # A Unix domain socket, which connects to just the path.
+            address = host
 
-    def __init__(self, stream_factory):
-        self.pid = os.getpid()
-        self.pool_size = 10
-        self.stream_factory = stream_factory
-        if not hasattr(self, "streams"):
-            self.streams = []
+        if timeout is not None:
+            deadline = self.stream.io_loop.add_timeout(time.time() + timeout,
+                                                       self.close)
+
+        def on_connect():
+            if timeout is not None:
+                self.stream.io_loop.remove_timeout(deadline)
+            self.connected = True
+            self.__connect_callback = None
+            callback(self)
+
+        self.stream.connect(address, on_connect)
+
+    def closed(self):
+        return self.quarantined or self.closing or self.stream.closed()
+
+    def close(self):
+        """Close the stream, once anything queued by :meth:`write_later`
+        has been written: those writes were reported done when queued.
+        """
+        if self.closing:
+            return
+        if self.__outgoing and not self.stream.closed():
+            self.closing = True
+            data = "".join(self.__outgoing)
+            self.__outgoing = []
+            self.__outgoing_bytes = 0
+            if self.metrics is not None:
+                self.metrics.bytes_written += len(data)
+            try:
+                self.stream.write(data, self.stream.close)
+                return
+            except (IOError, socket.error):
+                pass
+        self.stream.close()
+
+    def send(self, request_id, data, callback=None, timeout=None,
+             exhaust=False):
+        """Write `data` to the stream.
+
+        If `callback` is given it will be called with the body of the reply
+        whose ``responseTo`` is `request_id`, or with an instance of
+        :class:`~apymongo.errors.AutoReconnect` if the stream is lost or
+        no reply arrives within `timeout` seconds. If `exhaust`, it is
+        called with every reply the server streams back after that too.
+        """
+        if callback is not None:
+            self.__expect(request_id, callback, timeout)
+            if exhaust:
+                self.exhausting[request_id] = timeout
+        self.last_used = time.time()
+        if self.__outgoing:
+            # Anything queued has to go out first, so send it all at once.
+            self.__outgoing.append(data)
+            data = "".join(self.__outgoing)
+            self.__outgoing = []
+            self.__outgoing_bytes = 0
+        if self.metrics is not None:
+            self.metrics.bytes_written += len(data)
+        try:
+            self.stream.write(data)
+        except (IOError, socket.error), e:
+            self.pending.pop(request_id, None)
+            self.__clear_deadline(request_id)
+            self.close()
+            if callback is not None:
+                callback(AutoReconnect(str(e)))
+            return
+
+        if callback is not None and not self.reading:
+            self.reading = True
+            self.stream.read_bytes(16, self.__on_header)
+
+    def __expect(self, request_id, callback, timeout):
+        self.pending[request_id] = callback
+        if timeout is not None:
+            self.deadlines[request_id] = self.stream.io_loop.add_timeout(
+                time.time() + timeout,
+                functools.partial(self.__on_timeout, request_id, timeout))
 
+    def write_later(self, data, max_bytes):
+        """Queue `data`, which expects no reply, to be written along with
+        everything else queued on this channel.
 
-    def get_stream(self,callback):
+        The queue is written on the IOLoop's next iteration, or right away
+        once it holds `max_bytes` or more.
+        """
+        if not self.__outgoing:
+            self.stream.io_loop.add_callback(self.flush)
+        self.__outgoing.append(data)
+        self.__outgoing_bytes += len(data)
+        self.last_used = time.time()
+        if self.__outgoing_bytes >= max_bytes:
+            self.flush()
+
+    def flush(self):
+        """Write out anything queued by :meth:`write_later`.
+        """
+        if not self.__outgoing:
+            return
+        data = "".join(self.__outgoing)
+        self.__outgoing = []
+        self.__outgoing_bytes = 0
+        if self.stream.closed():
+            return
+        if self.metrics is not None:
+            self.metrics.bytes_written += len(data)
+        try:
+            self.stream.write(data)
+        except (IOError, socket.error):
+            self.close()
+
+    def __on_header(self, header):
+        (length, request_id, response_to, operation) = _HEADER.unpack(header)
+        self.stream.read_bytes(length - 16,
+                               functools.partial(self.__on_body, request_id,
+                                                 response_to, operation))
+
+    def __on_body(self, request_id, response_to, operation, body):
+        if self.metrics is not None:
+            self.metrics.bytes_read += 16 + len(body)
+        if operation == message.OP_COMPRESSED:
+            try:
+                body = message.decompress(body)
+            except (ValueError, zlib.error, struct.error):
+                # There's no telling what else on this stream is garbage.
+                self.close()
+                return
+        callback = self.pending.pop(response_to, None)
+        self.__clear_deadline(response_to)
+        if response_to in self.exhausting:
+            timeout = self.exhausting.pop(response_to)
+            if callback is not None and _more_to_come(body):
+                self.__expect(request_id, callback, timeout)
+                self.exhausting[request_id] = timeout
+
+        # Keep the read loop going as long as anyone is waiting.
+        if self.pending:
+            self.stream.read_bytes(16, self.__on_header)
+        else:
+            self.reading = False
+            if self.quarantined:
+                self.close()
+
+        if callback is not None:
+            callback(body)
+
+    def __on_timeout(self, request_id, timeout):
+        self.deadlines.pop(request_id, None)
+        self.exhausting.pop(request_id, None)
+        callback = self.pending.pop(request_id, None)
+        if callback is None:
+            return
+
+        # The reply would still be routed correctly if it ever turned up,
+        # but a server this slow shouldn't be given any more work on this
+        # stream.
+        self.quarantined = True
+        if not self.pending:
+            self.close()
+
+        callback(NetworkTimeout("no reply from %r within %s seconds" %
+                                (self.address, timeout)))
+
+    def __clear_deadline(self, request_id):
+        deadline = self.deadlines.pop(request_id, None)
+        if deadline is not None:
+            self.stream.io_loop.remove_timeout(deadline)
+
+    def __on_close(self):
+        self.reading = False
+        self.__outgoing = []
+        self.__outgoing_bytes = 0
+        for request_id in self.deadlines.keys():
+            self.__clear_deadline(request_id)
+        if self.__connect_callback is not None:
+            callback, self.__connect_callback = self.__connect_callback, None
+            callback(AutoReconnect("could not connect to %r" %
+                                   (self.address,)))
+        self.exhausting = {}
+        pending, self.pending = self.pending, {}
+        for callback in pending.itervalues():
+            callback(AutoReconnect("connection closed"))
+
+
+class _Pool(object):
+    """A bounded pool of channels to a single server.
+
+    Operations check a channel out for as long as they need it and check
+    it back in when they are done. At most `max_size` channels are open
+    (or being opened) at once. When all of them are checked out, further
+    checkouts queue up in FIFO order and are handed channels as they are
+    checked back in, failing with
+    :class:`~apymongo.errors.ConnectionFailure` if `wait_queue_timeout`
+    seconds pass first.
+
+    If `shared` is ``True`` (multiplexing) checkouts are not exclusive:
+    an idle channel is preferred, new channels are opened while there is
+    room, and after that the channel with the fewest outstanding requests
+    is shared.
+
+    Channels older than `max_lifetime` seconds are closed when they are
+    checked in; :meth:`check` takes care of idle ones.
+
+    A dedicated channel (for an exhaust query, which ties the channel up
+    until the server is done streaming) is opened outside of all that,
+    and closed when it is checked back in.
+    """
+
+    def __init__(self, stream_factory, io_loop=None, max_size=10,
+                 min_size=0, wait_queue_timeout=None, shared=False,
+                 max_idle_time=None, max_lifetime=None):
+        self.pid = os.getpid()
+        self.stream_factory = stream_factory
+        self.io_loop = io_loop
+        self.max_size = max_size
+        self.min_size = min_size
+        self.wait_queue_timeout = wait_queue_timeout
+        self.shared = shared
+        self.max_idle_time = max_idle_time
+        self.max_lifetime = max_lifetime
+        self.closed = False
+
+        self.channels = []
+        self.idle = collections.deque()
+        self.waiters = collections.deque()
+        self.opening = 0
+
+    def __loop(self):
+        return self.io_loop or tornado.ioloop.IOLoop.instance()
+
+    def __check_pid(self):
         # We use the pid here to avoid issues with fork / multiprocessing.
-        # See test.test_connection:TestConnection.test_fork for an example of
-        # what could go wrong otherwise
+        # The child forgets the parent's channels without closing them,
+        # since closing them could affect the parent.
         pid = os.getpid()
-
         if pid != self.pid:
-            self.sock = None
-            self.streams = []
+            self.channels = []
+            self.idle = collections.deque()
+            self.waiters = collections.deque()
+            self.opening = 0
             self.pid = pid
 
-        if self.stream is not None and self.stream[0] == pid:
-            callback(self.stream[1])
+    @property
+    def size(self):
+        """Number of channels that are open or being opened."""
+        return len(self.channels) + self.opening
+
+    def checkout(self, callback, dedicated=False, deadline=None):
+        """Pass a channel (or the error raised getting one) to `callback`.
+
+        Every successful checkout must be matched by a :meth:`checkin`.
+        If `dedicated`, the channel is a new one nobody else will get.
+        A checkout still waiting for a channel at `deadline` (a time, as
+        returned by :func:`time.time`) fails with
+        :class:`~apymongo.errors.NetworkTimeout`.
+        """
+        self.__check_pid()
 
-        try:
-            self.stream = (pid, self.streams.pop())
-        except IndexError:
-        
-            def stream_callback(strm):
-                if not isinstance(strm,Exception):
-                    self.stream = (pid,strm)
-                callback(strm)
-                
-            self.stream_factory(stream_callback)
-            
+        if dedicated:
+            self.__open_dedicated(callback)
+            return
+
+        if self.shared:
+            self.__checkout_shared(callback, deadline)
+            return
+
+        while self.idle:
+            channel = self.idle.pop()
+            if not channel.closed():
+                callback(channel)
+                return
+            self.__discard(channel)
+
+        if self.size < self.max_size:
+            self.__open(callback)
         else:
-            callback(self.stream[1])
-            
+            self.__wait(callback, deadline)
+
+    def __checkout_shared(self, callback, deadline):
+        best = None
+        for channel in list(self.channels):
+            if channel.closed():
+                if not channel.pending:
+                    self.__discard(channel)
+            elif best is None or len(channel.pending) < len(best.pending):
+                best = channel
+
+        full = self.size >= self.max_size
+        if best is not None and (full or not best.pending):
+            callback(best)
+        elif full:
+            # Every slot is still connecting - wait for one of them.
+            self.__wait(callback, deadline)
+        else:
+            self.__open(callback)
 
-    def return_stream(self):
-        if self.stream is not None and self.stream[0] == os.getpid():
-            # There's a race condition here, but we deliberately
-            # ignore it.  It means that if the pool_size is 10 we
-            # might actually keep slightly more than that.
-            if len(self.streams) < self.pool_size:
-                self.streams.append(self.stream[1])
-            else:
-                self.stream[1].close()
-        self.stream = None
+    def checkin(self, channel):
+        """Return a channel obtained from :meth:`checkout` to the pool.
+        """
+        if channel.dedicated:
+            channel.close()
+            return
 
+        if (self.closed or channel.closed() or channel.pid != os.getpid() or
+            self.__expired(channel, time.time())):
+            if not channel.pending:
+                self.__discard(channel)
+            return
 
-class Connection(object):  # TODO support auth for pooling
+        if self.shared:
+            return
+
+        if self.waiters:
+            self.__next_waiter()(channel)
+        else:
+            self.idle.append(channel)
+
+    def flush(self, keep=None):
+        """Write out what :meth:`_Channel.write_later` has queued on every
+        channel but `keep`.
+        """
+        for channel in self.channels:
+            if channel is not keep:
+                channel.flush()
+
+    def check(self, ping, idle_since):
+        """Look after the channels nobody is using.
+
+        Channels that have outlived `max_lifetime`, or have been idle for
+        more than `max_idle_time` while more than `min_size` channels are
+        open, are closed. Channels that haven't been used since
+        `idle_since` are checked out and passed to ``ping(channel,
+        done)``; ``done`` takes an exception if the channel turned out to
+        be dead, in which case it is discarded rather than checked back
+        in. Finally the pool is topped back up to `min_size` channels.
+        """
+        self.__check_pid()
+        if self.closed:
+            return
+
+        now = time.time()
+        for channel in list(self.channels):
+            if channel.pending or (not self.shared and
+                                   channel not in self.idle):
+                continue
+
+            if not self.shared:
+                self.idle.remove(channel)
+
+            if (channel.closed() or self.__expired(channel, now) or
+                (self.max_idle_time is not None and
+                 now - channel.last_used > self.max_idle_time and
+                 self.size > self.min_size)):
+                self.__discard(channel)
+            elif channel.last_used <= idle_since:
+                ping(channel, functools.partial(self.__pinged, channel,
+                                                channel.last_used))
+            elif not self.shared:
+                self.idle.append(channel)
+
+        if self.size < self.min_size:
+            self.fill(self.min_size, ping, lambda error: None)
+
+    def __pinged(self, channel, last_used, error=None):
+        # A ping doesn't count as use as far as max_idle_time goes.
+        channel.last_used = last_used
+        if error is not None:
+            channel.close()
+        self.checkin(channel)
+
+    def __expired(self, channel, now):
+        return (self.max_lifetime is not None and
+                now - channel.created > self.max_lifetime)
+
+    def fill(self, count, prepare, callback):
+        """Open channels in parallel until `count` of them are open.
+
+        Each new channel is passed to ``prepare(channel, done)`` before it
+        is checked in; ``done`` takes an exception if the channel turned
+        out to be unusable, in which case it is discarded. `callback` is
+        called with the first error seen, or ``None``, once every new
+        channel has been dealt with.
+        """
+        self.__check_pid()
+
+        wanted = min(count, self.max_size) - self.size
+        if wanted <= 0:
+            callback(None)
+            return
+
+        state = {"left": wanted, "error": None}
+
+        def finished(error):
+            if state["error"] is None:
+                state["error"] = error
+            state["left"] -= 1
+            if not state["left"]:
+                callback(state["error"])
+
+        def on_open(channel):
+            if isinstance(channel, Exception):
+                finished(channel)
+                return
+
+            def done(error=None):
+                if error is not None:
+                    channel.close()
+                self.checkin(channel)
+                finished(error)
+
+            prepare(channel, done)
+
+        for _ in range(wanted):
+            self.__open(on_open)
+
+    def close(self):
+        """Close the pool.
+
+        Idle channels are closed now, channels that are in use are closed
+        as they are checked back in. Anyone still waiting for a channel
+        gets a :class:`~apymongo.errors.AutoReconnect`.
+        """
+        self.closed = True
+        for channel in list(self.channels):
+            if not channel.pending and (self.shared or channel in self.idle):
+                self.__discard(channel)
+        self.idle = collections.deque()
+        while self.waiters:
+            self.__next_waiter()(AutoReconnect("connection pool was reset"))
+
+    def __open(self, callback):
+        self.opening += 1
+
+        def on_open(channel):
+            self.opening -= 1
+            if isinstance(channel, Exception):
+                # Nothing is open to hand to the waiters, and nothing
+                # will be - let them know now rather than at their timeout.
+                waiters = []
+                if not self.channels:
+                    while self.waiters:
+                        waiters.append(self.__next_waiter())
+                callback(channel)
+                for waiter in waiters:
+                    waiter(channel)
+                return
+
+            channel.pool = self
+            channel.pid = self.pid
+            self.channels.append(channel)
+            callback(channel)
+            if self.shared:
+                while self.waiters:
+                    self.__next_waiter()(channel)
+
+        self.stream_factory(on_open)
+
+    def __open_dedicated(self, callback):
+        def on_open(channel):
+            if not isinstance(channel, Exception):
+                channel.pool = self
+                channel.pid = self.pid
+                channel.dedicated = True
+            callback(channel)
+
+        self.stream_factory(on_open)
+
+    def __wait(self, callback, deadline=None):
+        waiter = [callback, None]
+
+        error = None
+        if self.wait_queue_timeout is not None:
+            error = ConnectionFailure("timed out waiting for a connection "
+                                      "from the pool")
+            wait_until = time.time() + self.wait_queue_timeout
+        if deadline is not None and (error is None or deadline < wait_until):
+            error = NetworkTimeout("timed out waiting for a connection "
+                                   "from the pool")
+            wait_until = deadline
+
+        if error is not None:
+            def on_timeout():
+                self.waiters.remove(waiter)
+                callback(error)
+
+            waiter[1] = self.__loop().add_timeout(wait_until, on_timeout)
+
+        self.waiters.append(waiter)
+
+    def __next_waiter(self):
+        (callback, timeout) = self.waiters.popleft()
+        if timeout is not None:
+            self.__loop().remove_timeout(timeout)
+        return callback
+
+    def __discard(self, channel):
+        if channel in self.channels:
+            self.channels.remove(channel)
+        if not channel.closed():
+            channel.close()
+
+        # A slot just freed up - use it for whoever has waited longest.
+        if (self.waiters and not self.closed and
+            self.size < self.max_size):
+            self.__open(self.__next_waiter())
+
+
+class _CircuitBreaker(object):
+    """Keeps operations away from a node that keeps failing.
+
+    After `threshold` consecutive failures the breaker opens and the node
+    gets no operations for `reset_timeout` seconds. Then it is half-open:
+    a single operation is let through as a probe, and closes the breaker
+    if it succeeds or opens it again if it fails.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = range(3)
+
+    def __init__(self, threshold, reset_timeout):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.changed = None
+
+    def available(self):
+        """Would :meth:`allow` let an operation through?
+        """
+        return (self.state == self.CLOSED or
+                time.time() - self.changed >= self.reset_timeout)
+
+    def allow(self):
+        """May an operation be sent now? If this lets a probe through, no
+        other is until it finishes (or `reset_timeout` passes).
+        """
+        if not self.available():
+            return False
+        if self.state != self.CLOSED:
+            self.state = self.HALF_OPEN
+            self.changed = time.time()
+        return True
+
+    def succeeded(self):
+        self.state = self.CLOSED
+        self.failures = 0
+
+    def failed(self):
+        self.failures += 1
+        if self.state == self.HALF_OPEN or self.failures >= self.threshold:
+            self.state = self.OPEN
+            self.changed = time.time()
+
+
+class _Node(object):
+    """What the topology monitor has learned about one server.
+    """
+
+    def __init__(self, address):
+        self.address = address
+        self.up = False
+        self.ismaster = False
+        self.secondary = False
+        self.max_wire_version = 0
+        self.rtt = None
+        self.last_checked = None
+        self.checking = False
+        self.channel = None
+
+    def record(self, response, rtt):
+        """Record a successful ``ismaster`` that took `rtt` seconds.
+        """
+        self.up = True
+        self.ismaster = bool(response.get("ismaster"))
+        self.secondary = bool(response.get("secondary"))
+        self.max_wire_version = response.get("maxWireVersion", 0)
+        if self.rtt is None:
+            self.rtt = rtt
+        else:
+            # Smooth out the odd slow check.
+            self.rtt = 0.8 * self.rtt + 0.2 * rtt
+        self.last_checked = time.time()
+
+    def record_failure(self):
+        self.up = self.ismaster = self.secondary = False
+        self.rtt = None
+        self.last_checked = time.time()
+        if self.channel is not None:
+            self.channel.close()
+            self.channel = None
+
+
+class Connection(object):
     """Connection to MongoDB.
     """
 
@@ -225,7 +898,18 @@ class Connection(object):  # TODO support auth for pooling
     def __init__(self, host=None, port=None, pool_size=None,io_loop=None,
                  auto_start_request=None, timeout=None, slave_okay=False,
                  network_timeout=None, document_class=dict, tz_aware=False,
-                 _connect=True):
+                 multiplex=False, max_pool_size=10, min_pool_size=0,
+                 wait_queue_timeout=None, warm_up=False, on_ready=None,
+                 idle_check_interval=10, max_idle_time=None,
+                 max_lifetime=None, heartbeat_frequency=10,
+                 read_preference=None, secondary_acceptable_latency_ms=15,
+                 max_buffered_ops=1000, buffer_timeout=10,
+                 coalesce_writes=False, max_coalesced_bytes=65536,
+                 event_listeners=None, connect=True, compressors=None,
+                 zlib_compression_level=-1, compression_threshold=1024,
+                 max_in_flight=None, max_in_flight_queue=100,
+                 breaker_threshold=5, breaker_reset_timeout=5,
+                 hedge_percentile=None, metrics=True, _connect=True):
         """Create a new connection to a single MongoDB instance at *host:port*.
 
         The resultant connection object has connection-pooling built
@@ -258,16 +942,131 @@ class Connection(object):  # TODO support auth for pooling
           - `pool_size` (optional): DEPRECATED
           - `auto_start_request` (optional): DEPRECATED
           - `slave_okay` (optional): is it okay to connect directly to
-            and perform queries on a slave instance
+            and perform queries on a slave instance. Unless a
+            `read_preference` is given this means
+            :attr:`~apymongo.read_preferences.ReadPreference.SECONDARY_PREFERRED`
           - `timeout` (optional): DEPRECATED
-          - `network_timeout` (optional): timeout (in seconds) to use
-            for socket operations - default is no timeout
+          - `network_timeout` (optional): timeout (in seconds) to wait
+            for the server to reply to an operation, counting from when
+            the operation starts (so including any wait for a primary or
+            a free connection) - default is no timeout. Operations that
+            time out fail with
+            :class:`~pymongo.errors.NetworkTimeout`. Can be overridden
+            for a single operation by passing `network_timeout` to it
           - `document_class` (optional): default class to use for
             documents returned from queries on this connection
           - `tz_aware` (optional): if ``True``,
             :class:`~datetime.datetime` instances returned as values
             in a document by this :class:`Connection` will be timezone
             aware (otherwise they will be naive)
+          - `multiplex` (optional): if ``True``, operations share the
+            pooled streams and many requests can be outstanding on a
+            stream at once, with each reply routed to its caller by
+            request id. Otherwise each operation gets a stream to itself
+          - `max_pool_size` (optional): the maximum number of streams
+            to keep open to the server. Operations that find every
+            stream in use wait for one to be returned to the pool
+          - `min_pool_size` (optional): the number of streams the pool
+            tries to keep open even when they are idle
+          - `wait_queue_timeout` (optional): how long (in seconds) an
+            operation will wait for a stream from the pool before
+            failing with :class:`~pymongo.errors.ConnectionFailure` -
+            default is to wait indefinitely
+          - `warm_up` (optional): if ``True``, open and verify
+            `min_pool_size` streams (at least one) in parallel as soon
+            as the server has been found, so that the first operations
+            don't pay for connecting
+          - `on_ready` (optional): callback that is passed this
+            :class:`Connection` once the server has been found and any
+            warm-up is done, or the exception if that failed. See
+            :meth:`when_ready`
+          - `idle_check_interval` (optional): how often (in seconds)
+            idle streams are checked in the background. Streams that
+            haven't been used since the last check are pinged and
+            discarded if they don't answer, so that dead streams are
+            found before an operation tries to use them. ``None``
+            disables the checks
+          - `max_idle_time` (optional): close streams that have been
+            idle for longer than this many seconds, down to
+            `min_pool_size` streams
+          - `max_lifetime` (optional): close streams that have been
+            open for longer than this many seconds once they are idle
+          - `heartbeat_frequency` (optional): how often (in seconds)
+            every known node is sent ``ismaster`` in the background to
+            keep track of which one is primary and how long round trips
+            to each take. ``None`` disables the checks, so a new primary
+            is only looked for after an operation fails
+          - `read_preference` (optional): the default
+            :class:`~apymongo.read_preferences.ReadPreference` for
+            queries on this connection. Each node has its own pool, so
+            reads sent to secondaries don't compete with the primary's
+            streams
+          - `secondary_acceptable_latency_ms` (optional): when more than
+            one node is eligible for a read, any of those whose round
+            trip time is within this many milliseconds of the fastest
+            may be picked
+          - `max_buffered_ops` (optional): while no primary is known
+            (during initial discovery or a failover) up to this many
+            operations are held back and sent once a primary is found,
+            rather than failing right away with
+            :class:`~apymongo.errors.AutoReconnect`. ``0`` disables
+            buffering
+          - `buffer_timeout` (optional): how long (in seconds) a buffered
+            operation waits for a primary before failing with
+            :class:`~apymongo.errors.AutoReconnect`. ``None`` means no
+            limit
+          - `coalesce_writes` (optional): queue unacknowledged writes
+            (``safe=False`` inserts, updates and removes) on their
+            stream and write them out together once per IOLoop
+            iteration, instead of one socket write each. Queued writes
+            are written out before a stream to the same node is handed
+            to another operation, but the server only keeps operations
+            on the same stream in order
+          - `max_coalesced_bytes` (optional): with `coalesce_writes`,
+            write a stream's queue out right away once it holds this
+            many bytes
+          - `event_listeners` (optional): a list of
+            :class:`~apymongo.monitoring.OperationListener` instances to
+            be told when each operation starts, succeeds or fails
+          - `connect` (optional): if ``False`` nothing is done (no IOLoop
+            is touched, no sockets opened) until the first operation. Use
+            this for a Connection created before
+            :func:`tornado.process.fork_processes`; see
+            :meth:`after_fork`
+          - `compressors` (optional): wire compressors to offer the
+            server. Only ``["zlib"]`` is supported. Each new stream
+            offers them in an ``ismaster`` handshake; messages on a
+            stream the server agreed for (servers >= 3.4) are sent as
+            OP_COMPRESSED, and it answers in kind. Handshake and
+            authentication commands are never compressed
+          - `zlib_compression_level` (optional): the zlib level to use,
+            from 0 to 9 (-1 for zlib's default)
+          - `compression_threshold` (optional): messages smaller than
+            this many bytes are never compressed
+          - `max_in_flight` (optional): the most operations that may be
+            outstanding to any one node at a time. ``None`` means no
+            limit
+          - `max_in_flight_queue` (optional): with `max_in_flight`, how
+            many more operations may wait (in order) for one to finish.
+            Beyond that operations fail right away with
+            :class:`~apymongo.errors.OverloadedError`
+          - `breaker_threshold` (optional): after this many operations in
+            a row fail to reach a node, stop sending it any for
+            `breaker_reset_timeout` seconds. Reads that may go elsewhere
+            do; others fail right away with
+            :class:`~apymongo.errors.AutoReconnect`. After that a single
+            operation is let through to see if the node is back.
+            ``None`` disables this
+          - `breaker_reset_timeout` (optional): see `breaker_threshold`
+          - `hedge_percentile` (optional): hedge the first batch of reads
+            that may go to more than one node (any read preference but
+            ``PRIMARY``): if the node chosen hasn't answered within this
+            percentile (e.g. ``95``) of the collection's recent query
+            latency, send the query to a second eligible node as well and
+            use whichever reply comes first. ``None`` disables hedging
+          - `metrics` (optional): if ``False``, don't keep
+            :attr:`metrics`. Keeping them costs a few microseconds per
+            operation
 
         .. seealso:: :meth:`end_request`
         .. versionchanged:: 1.8
@@ -320,6 +1119,23 @@ class Connection(object):  # TODO support auth for pooling
         if pool_size is not None:
             warnings.warn("The pool_size parameter to Connection is "
                           "deprecated", DeprecationWarning)
+        if not isinstance(max_pool_size, int) or max_pool_size < 1:
+            raise ConfigurationError("max_pool_size must be a positive int")
+        if not isinstance(min_pool_size, int) or min_pool_size < 0:
+            raise ConfigurationError("min_pool_size must be a "
+                                     "non-negative int")
+        if min_pool_size > max_pool_size:
+            raise ConfigurationError("min_pool_size cannot be larger "
+                                     "than max_pool_size")
+        if max_in_flight is not None and (not isinstance(max_in_flight, int)
+                                          or max_in_flight < 1):
+            raise ConfigurationError("max_in_flight must be a positive int")
+        if not isinstance(max_in_flight_queue, int) or max_in_flight_queue < 0:
+            raise ConfigurationError("max_in_flight_queue must be a "
+                                     "non-negative int")
+        if not isinstance(max_buffered_ops, int) or max_buffered_ops < 0:
+            raise ConfigurationError("max_buffered_ops must be a "
+                                     "non-negative int")
         if auto_start_request is not None:
             warnings.warn("The auto_start_request parameter to Connection "
                           "is deprecated", DeprecationWarning)
@@ -337,9 +1153,12 @@ class Connection(object):  # TODO support auth for pooling
         else:
             self.__slave_okay = slave_okay
 
-        if slave_okay and len(self.__nodes) > 1:
-            raise ConfigurationError("cannot specify slave_okay for a paired "
-                                     "or replica set connection")
+        if read_preference is None:
+            read_preference = (self.__slave_okay and
+                               ReadPreference.SECONDARY_PREFERRED or
+                               ReadPreference.PRIMARY)
+        self.__read_preference = read_preferences.validate(read_preference)
+        self.__latency_window = secondary_acceptable_latency_ms / 1000.0
 
         # TODO - Support using other options like w and fsync from URI
         self.__options = options
@@ -348,23 +1167,90 @@ class Connection(object):  # TODO support auth for pooling
 
         self.__cursor_manager = CursorManager(self)
 
-        self.__pool = _Pool(self.__connect)
-        self.__last_checkout = time.time()
-
         self.__network_timeout = network_timeout
+        self.__multiplex = multiplex
+        self.__max_pool_size = max_pool_size
+        self.__min_pool_size = min_pool_size
+        self.__wait_queue_timeout = wait_queue_timeout
+        self.__idle_check_interval = idle_check_interval
+        self.__max_idle_time = max_idle_time
+        self.__max_lifetime = max_lifetime
+        self.__heartbeat_frequency = heartbeat_frequency
+
+        self.__node_states = {}
+        self.__pools = {}
+        self.__credentials = {}
+        self.__metrics = metrics and Metrics(self.__pool_gauges) or None
+        self.__listeners = list(event_listeners or [])
+        self.__encode_times = {}
+
+        for compressor in compressors or []:
+            if compressor not in message._COMPRESSOR_IDS:
+                raise ConfigurationError("unsupported compressor: %r" %
+                                         (compressor,))
+        if zlib_compression_level not in range(-1, 10):
+            raise ConfigurationError("zlib_compression_level must be "
+                                     "between -1 and 9")
+        self.__compressors = list(compressors or [])
+        self.__zlib_compression_level = zlib_compression_level
+        self.__compression_threshold = compression_threshold
+
+        self.__coalesce_writes = coalesce_writes
+        self.__max_coalesced_bytes = max_coalesced_bytes
+
+        self.__breaker_threshold = breaker_threshold
+        self.__breaker_reset_timeout = breaker_reset_timeout
+        self.__breakers = {}
+
+        self.__hedge_percentile = hedge_percentile
+        self.__hedge_latency = {}
+
+        self.__max_in_flight = max_in_flight
+        self.__max_in_flight_queue = max_in_flight_queue
+        self.__in_flight = {}
+        self.__admission_queues = {}
+
+        self.__max_buffered_ops = max_buffered_ops
+        self.__buffer_timeout = buffer_timeout
+        self.__buffered = collections.deque()
+        self.__reconnect_attempts = 0
+        self.__reconnect_timeout = None
+
+        self.__warm_up = warm_up
+        self.__warming = False
+        self.__ready = False
+        self.__ready_error = None
+        self.__ready_callbacks = []
+        if on_ready is not None:
+            self.when_ready(on_ready)
+
         self.__document_class = document_class
         self.__tz_aware = tz_aware
 
         # cache of existing indexes used by ensure_index ops
         self.__index_cache = {}
 
+        self.__pid = os.getpid()
+        self.__generation = 0
+        self.__started = False
+        self.__lazy = False
         if _connect:
-            self.__find_master()
-
-        if username:
+            if connect:
+                self.__start(strict=True)
+            else:
+                self.__lazy = True
+
+        if username and self.__lazy:
+            # Don't check the credentials now, just apply them to each
+            # stream as it is first used.
+            database = database or "admin"
+            self.__credentials[database] = (database, unicode(username),
+                                            password)
+        elif username:
             database = database or "admin"  
             def auth_err(x):
-                if not x: raise ConfigurationError("authentication failed")
+                if not x or isinstance(x, Exception):
+                    raise ConfigurationError("authentication failed")
 
             self[database].authenticate(username, password, auth_err)
             
@@ -487,6 +1373,13 @@ class Connection(object):  # TODO support auth for pooling
         """
         return self.__slave_okay
 
+    @property
+    def read_preference(self):
+        """The default :class:`~apymongo.read_preferences.ReadPreference`
+        for queries on this connection.
+        """
+        return self.__read_preference
+
     def get_document_class(self):
         return self.__document_class
 
@@ -511,98 +1404,785 @@ class Connection(object):  # TODO support auth for pooling
         return self.__tz_aware
 
 
-    def __find_master(self):
+    def __find_master(self, strict=False):
+        """Find the primary by probing every known node at once.
+
+        The first node to report itself primary is used. If none has by
+        the time every probe (including probes of any nodes discovered on
+        the way) has finished, the connection becomes ready with an
+        :class:`~pymongo.errors.AutoReconnect` instead (which is also
+        raised, if `strict`).
         """
-           do it and downstream with callbacks
+        # In the usual single server case there is only one candidate, so
+        # use it until we hear otherwise. With several seeds operations
+        # are buffered until one of them turns out to be primary.
+        if len(self.__nodes) == 1:
+            self.__set_primary(iter(self.__nodes).next())
+        self.__check_topology(functools.partial(self.__on_first_check,
+                                                strict))
+
+    def __on_first_check(self, strict):
+        if not self.__ready and not self.__warming:
+            error = AutoReconnect("could not find master/primary")
+            self.__set_ready(error)
+            if strict:
+                raise error
+
+    def __check_topology(self, callback=None):
+        """Send ``ismaster`` to every known node concurrently and update
+        what we know about them, calling `callback` once all are done.
         """
-        # Special case the first node to try to get the primary or any
-        # additional hosts from a replSet:
-        first = iter(self.__nodes).next()
+        state = {"left": 0}
 
-        callback = self.__callback_master
-        self.__try_node(first,callback)
-        
+        def probed():
+            state["left"] -= 1
+            if not state["left"] and callback is not None:
+                callback()
 
-    def __try_node(self, node,callback):
-        self.disconnect()
-        self.__host, self.__port = node
-        self.admin.command("ismaster",callback=callback)
-        
+        def probe(address):
+            state["left"] += 1
+            self.__probe(address, probe, probed)
 
-    def __callback_master(self,response):
-           
-        if isinstance(response,Exception):
-            raise response
-            
+        for address in list(self.__nodes):
+            probe(address)
+
+    def __probe(self, address, discovered, callback):
+        """Check a single node on its own monitoring channel.
+
+        Nodes we hadn't heard of before are passed to `discovered`.
+        """
+        node = self.__node_states.get(address)
+        if node is None:
+            node = self.__node_states[address] = _Node(address)
+        if node.checking:
+            callback()
+            return
+        node.checking = True
+
+        def on_result(response, rtt=None):
+            node.checking = False
+            if isinstance(response, Exception):
+                node.record_failure()
+                self.__close_pool(address)
+            else:
+                node.record(response, rtt)
+                hosts = response.get("hosts", []) + response.get("passives", [])
+                for host in hosts:
+                    host = _str_to_node(host)
+                    if host not in self.__nodes:
+                        self.__nodes.add(host)
+                        discovered(host)
+            self.__update_primary(node)
+            callback()
+
+        def on_channel(strm):
+            if isinstance(strm, Exception):
+                on_result(strm)
+                return
+            node.channel = strm
+            start = time.time()
+
+            def on_ismaster(response):
+                on_result(response, time.time() - start)
+
+            self.__ismaster(strm, on_ismaster, self.__heartbeat_frequency)
+
+        if node.channel is None or node.channel.closed():
+            self.__connect_to(address, on_channel)
         else:
-       
-            primary = self.__add_hosts_and_get_primary(response)
-            self.end_request()
-            
-            if response["ismaster"]:
-                primary = True
-     
-            if (primary is True) or (self.__slave_okay and primary is not None):
-                return 
-            else:        
-                raise AutoReconnect("could not find master/primary")
-        
+            on_channel(node.channel)
 
-    def __add_hosts_and_get_primary(self, response):
-        if "hosts" in response:
-            self.__nodes.update([_str_to_node(h) for h in response["hosts"]])
-        if "primary" in response:
-            return _str_to_node(response["primary"])
-        return False
+    def __update_primary(self, node):
+        """Switch primaries if what we just learned about `node` calls for
+        it. With `slave_okay` a lone node is used whatever its state.
+        """
+        usable = node.ismaster or (node.up and self.__slave_okay and
+                                   len(self.__nodes) == 1)
+        current = (self.__host, self.__port)
+        if usable:
+            if node.address != current:
+                self.__set_primary(node.address)
+            self.__found_primary()
+            self.__flush_buffered()
+        elif node.address == current:
+            self.__set_primary(None)
+            self.__schedule_reconnect()
+
+    def __set_primary(self, address):
+        """Point this connection at a new primary (or at nothing, if
+        `address` is ``None``).
+
+        Each node keeps its own pool, so streams to a demoted primary can
+        go on serving reads.
+        """
+        self.__host, self.__port = address or (None, None)
 
+    def __found_primary(self):
+        """The primary has been confirmed: warm up if asked to, and let
+        anyone waiting know the connection is ready.
 
-    def __connect(self,callback):
-        """(Re-)connect to Mongo and return a new (connected) socket.
+        This also recovers a connection that became ready with an error
+        because no primary was found at first.
+        """
+        if (self.__ready and self.__ready_error is None) or self.__warming:
+            return
+        self.__ready = False
+        self.__ready_error = None
+        if self.__warm_up:
+            self.__warming = True
+            self.__pool_for((self.__host, self.__port)).fill(
+                max(self.__min_pool_size, 1), self.__verify, self.__set_ready)
+        else:
+            self.__set_ready(None)
 
-        Connect to the master if this is a paired connection.
+    def __buffer(self, callback, read_preference, dedicated=False,
+                 deadline=None):
+        """Hold on to an operation that needs a primary until one is found.
+
+        The operation is failed right away if the buffer is full, or
+        later if no primary turns up within `buffer_timeout` or by the
+        operation's own `deadline`.
         """
-        host, port = self.__host, self.__port
-        
+        if len(self.__buffered) >= self.__max_buffered_ops:
+            callback(AutoReconnect("no primary available"))
+            return
+
+        entry = [callback, read_preference, dedicated, deadline, None]
+
+        error = None
+        if self.__buffer_timeout is not None:
+            error = AutoReconnect("no primary found within %s seconds" %
+                                  self.__buffer_timeout)
+            wait_until = time.time() + self.__buffer_timeout
+        if deadline is not None and (error is None or deadline < wait_until):
+            error = NetworkTimeout("no primary found before the operation "
+                                   "timed out")
+            wait_until = deadline
+
+        if error is not None:
+            def on_timeout():
+                self.__buffered.remove(entry)
+                callback(error)
+
+            entry[4] = self.__get_io_loop().add_timeout(wait_until,
+                                                        on_timeout)
+
+        self.__buffered.append(entry)
+        self.__schedule_reconnect()
+
+    def __flush_buffered(self):
+        """A primary has been found: send everything that was waiting.
+        """
+        self.__reconnect_attempts = 0
+        if self.__reconnect_timeout is not None:
+            self.__get_io_loop().remove_timeout(self.__reconnect_timeout)
+            self.__reconnect_timeout = None
+
+        buffered, self.__buffered = self.__buffered, collections.deque()
+        for (callback, read_preference, dedicated, deadline,
+             timeout) in buffered:
+            if timeout is not None:
+                self.__get_io_loop().remove_timeout(timeout)
+            self.__stream(callback, None, read_preference, dedicated,
+                          deadline)
+
+    def __schedule_reconnect(self):
+        """Look for a primary again after a randomized, exponentially
+        growing delay, unless that is already scheduled.
+        """
+        if self.__reconnect_timeout is not None:
+            return
+        bound = min(_RECONNECT_BACKOFF_MAX,
+                    _RECONNECT_BACKOFF_MIN * 2 ** self.__reconnect_attempts)
+        self.__reconnect_attempts += 1
+        self.__reconnect_timeout = self.__get_io_loop().add_timeout(
+            time.time() + random.uniform(_RECONNECT_BACKOFF_MIN, bound),
+            self.__reconnect)
+
+    def __reconnect(self):
+        self.__reconnect_timeout = None
+        if self.__host is not None:
+            return
+
+        def checked():
+            if self.__host is None and self.__buffered:
+                self.__schedule_reconnect()
+
+        self.__check_topology(checked)
+
+    @property
+    def metrics(self):
+        """The :class:`~apymongo.metrics.Metrics` kept for this
+        connection: pool checkouts, streams, bytes and operation
+        latencies. ``None`` if it was created with ``metrics=False``.
+        """
+        return self.__metrics
+
+    def __pool_gauges(self):
+        for (address, pool) in self.__pools.items():
+            if pool.shared:
+                idle = len([ch for ch in pool.channels if not ch.pending])
+            else:
+                idle = len(pool.idle)
+            yield (address, len(pool.channels), idle)
+
+    @property
+    def topology(self):
+        """What the background monitor knows about each node.
+
+        A dict mapping each ``(host, port)`` that has been checked to a
+        dict with ``up``, ``ismaster`` and ``secondary`` flags, ``rtt``
+        (a moving average of ``ismaster`` round trip times, in seconds,
+        or ``None`` if the node is down) and ``last_checked``.
+
+        See the `heartbeat_frequency` parameter to :class:`Connection`.
+        """
+        return dict((address, {"up": node.up,
+                               "ismaster": node.ismaster,
+                               "secondary": node.secondary,
+                               "rtt": node.rtt,
+                               "last_checked": node.last_checked})
+                    for (address, node) in self.__node_states.iteritems())
+
+    def __set_ready(self, error):
+        self.__ready = True
+        self.__warming = False
+        self.__ready_error = error
+        callbacks, self.__ready_callbacks = self.__ready_callbacks, []
+        for callback in callbacks:
+            callback(error or self)
+
+    def when_ready(self, callback):
+        """Call `callback` once this connection is ready for use.
+
+        The connection is ready once the server has been found and, if
+        `warm_up` was requested, the pool has been filled. `callback` is
+        passed this :class:`Connection`, or the exception that kept it
+        from becoming ready. If the connection is already ready
+        `callback` is called right away.
+        """
+        if self.__ready:
+            callback(self.__ready_error or self)
+        else:
+            self.__ready_callbacks.append(callback)
+
+    def __command_on(self, strm, db_name, command, callback, timeout=None):
+        """Run `command` on database `db_name` directly over `strm` and
+        pass the response document (or the error) to `callback`.
+        """
+        if timeout is None:
+            timeout = self.__network_timeout
+        (request_id, data) = message.query(0, db_name + ".$cmd", 0, -1,
+                                           command)
+
+        def on_reply(resp):
+            if isinstance(resp, Exception):
+                callback(resp)
+                return
+            try:
+                result = helpers._unpack_response(resp)["data"][0]
+            except (AutoReconnect, OperationFailure), e:
+                callback(e)
+                return
+            callback(result)
+
+        strm.send(request_id, data, on_reply, timeout)
+
+    def __ismaster(self, strm, callback, timeout=None):
+        """Send ``ismaster`` directly on `strm` and pass the response
+        document (or the error) to `callback`.
+        """
+
+        def on_result(result):
+            if not isinstance(result, Exception) and not result.get("ok"):
+                result = AutoReconnect("ismaster failed on %r" %
+                                       (strm.address,))
+            callback(result)
+
+        command = SON([("ismaster", 1)])
+        if self.__compressors:
+            command["compression"] = self.__compressors
+        self.__command_on(strm, "admin", command, on_result, timeout)
+
+    def __auth_on(self, strm, credentials, callback):
+        """Authenticate `strm` with `credentials`, a ``(database, user,
+        password)`` tuple, passing ``None`` or the error to `callback`.
+        """
+        (db_name, user, password) = credentials
+
+        def on_authenticate(result):
+            if isinstance(result, Exception):
+                callback(result)
+            elif not result.get("ok"):
+                callback(OperationFailure("authentication failed on %r: %s" %
+                                          (db_name, result.get("errmsg"))))
+            else:
+                # Authenticating replaces whoever was logged in to the
+                # database on this stream before.
+                strm.authset = set(other for other in strm.authset
+                                   if other[0] != db_name)
+                strm.authset.add(credentials)
+                callback(None)
+
+        def on_nonce(result):
+            if isinstance(result, Exception):
+                callback(result)
+                return
+            if not result.get("ok"):
+                callback(OperationFailure("getnonce failed on %r" %
+                                          (db_name,)))
+                return
+            nonce = result["nonce"]
+            key = helpers._auth_key(nonce, user, password)
+            self.__command_on(strm, db_name,
+                              SON([("authenticate", 1), ("user", user),
+                                   ("nonce", nonce), ("key", key)]),
+                              on_authenticate)
+
+        self.__command_on(strm, db_name, SON([("getnonce", 1)]), on_nonce)
+
+    def __prepare(self, callback, requested, address, strm):
+        """Bring `strm`'s authentication in line with the credentials
+        registered on this connection, then pass it to `callback`.
+
+        This only costs a round trip the first time a stream is used
+        after credentials change, so a stream authenticates once for its
+        whole life.
+        """
+        if isinstance(strm, Exception):
+            self.__record_outcome(address, strm)
+            self.__release(address)
+            callback(strm)
+            return
+        strm.checkout_wait = time.time() - requested
+        if self.__metrics is not None:
+            self.__metrics.checked_out(strm.checkout_wait)
+        if self.__coalesce_writes:
+            # Writes queued on the node's other streams go out before
+            # anything is sent on this one.
+            self.__pool_for(address).flush(strm)
+        self.__sync_auth(strm, callback)
+
+    def __sync_auth(self, strm, callback):
+        """The authentication half of :meth:`__prepare`.
+
+        A shared stream may be checked out again while it is still
+        authenticating; the server keeps one nonce per connection, so
+        later checkouts wait for the handshake under way (see
+        :meth:`__lock_auth`) rather than start another.
+        """
+        credentials = set(self.__credentials.itervalues())
+        if strm.authset == credentials and strm.authenticating is None:
+            callback(strm)
+            return
+        if not self.__lock_auth(strm, functools.partial(self.__sync_auth,
+                                                        strm, callback)):
+            return
+        stale = list(strm.authset - credentials)
+        needed = list(credentials - strm.authset)
+
+        def step(error=None):
+            if isinstance(error, Exception):
+                self.__unlock_auth(strm)
+                self.__checkin(strm)
+                callback(error)
+            elif stale:
+                old = stale.pop()
+                strm.authset.discard(old)
+                self.__command_on(strm, old[0], SON([("logout", 1)]), step)
+            elif needed:
+                self.__auth_on(strm, needed.pop(), step)
+            else:
+                self.__unlock_auth(strm)
+                callback(strm)
+
+        step()
+
+    def __lock_auth(self, strm, retry):
+        """Start authenticating `strm`, returning ``True``, unless that is
+        already under way, in which case `retry` is called once it is
+        done and ``False`` is returned.
+        """
+        if strm.authenticating is not None:
+            strm.authenticating.append(retry)
+            return False
+        strm.authenticating = []
+        return True
+
+    def __unlock_auth(self, strm):
+        waiters, strm.authenticating = strm.authenticating, None
+        for waiter in waiters:
+            waiter()
+
+    def _authenticate(self, db_name, user, password, callback=None):
+        """Check `user` and `password` against database `db_name` and,
+        if they are good, use them on every stream from now on.
+
+        Passes ``True`` or ``False`` to `callback`, or the error if the
+        check couldn't be made.
+        """
+        credentials = (db_name, unicode(user), password)
+
+        def on_auth(strm, error):
+            if isinstance(error, OperationFailure):
+                result = False
+            elif isinstance(error, Exception):
+                result = error
+            else:
+                self.__credentials[db_name] = credentials
+                result = True
+            # Only now that the credentials are registered may anyone
+            # waiting bring the stream in line with them.
+            self.__unlock_auth(strm)
+            self.__checkin(strm)
+            if callback is not None:
+                callback(result)
+
+        def on_stream(strm):
+            if isinstance(strm, Exception):
+                if callback is not None:
+                    callback(strm)
+            elif self.__lock_auth(strm, functools.partial(on_stream, strm)):
+                self.__auth_on(strm, credentials,
+                               functools.partial(on_auth, strm))
+
+        self.__stream(on_stream)
+
+    def _logout(self, db_name):
+        """Stop using the credentials registered for database `db_name`.
+
+        Each stream logs out the next time it is used.
+        """
+        self.__credentials.pop(db_name, None)
+
+    def __verify(self, strm, callback, timeout=None):
+        """Check that a newly opened channel can talk to the server.
+
+        Passes ``None`` to `callback` if it can, the error otherwise.
+        """
+
+        def on_ismaster(result):
+            if isinstance(result, Exception):
+                callback(result)
+            else:
+                callback(None)
+
+        self.__ismaster(strm, on_ismaster, timeout)
+
+    def __connect_to(self, address, callback):
+        """Connect to `address` and pass a new (connected) channel to
+        `callback`.
+        """
+        if address is None:
+            callback(AutoReconnect("no primary available"))
+            return
+
         try:
-            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM, 0)
-            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            if address[1] is None:
+                sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM, 0)
+            else:
+                sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM, 0)
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
             stream = tornado.iostream.IOStream(sock,self.__io_loop)
-        except:
-            self.disconnect()
-            raise AutoReconnect("could not connect to %r" % list(self.__nodes))
+        except socket.error:
+            callback(AutoReconnect("could not connect to %r" % (address,)))
         else:
-            def scallback():
-                callback(stream)
             try:
-                stream.connect((host,port),callback=scallback)
+                channel = _Channel(stream)
+                channel.metrics = self.__metrics
+                channel.connect(address, callback, _CONNECT_TIMEOUT)
             except:
                 callback(ConnectionFailure())
-        
-                         
 
-    def __stream(self,callback):
-        """Get a socket from the pool.
+    def __open_channel(self, address, callback):
+        """Open a pooled channel to `address` and pass it (or the error)
+        to `callback`.
 
-        If it's been > 1 second since the last time we checked out a
-        socket, we also check to see if the socket has been closed -
-        this let's us avoid seeing *some*
-        :class:`~pymongo.errors.AutoReconnect` exceptions on server
-        hiccups, etc. We only do this if it's been > 1 second since
-        the last socket checkout, to keep performance reasonable - we
-        can't avoid those completely anyway.
+        With `compressors` the channel first sends ``ismaster`` to agree
+        on one with the server, as compression is negotiated for each
+        connection.
         """
-        
-        def scallback(strm):
-            t = time.time()
-            if t - self.__last_checkout > 1 and strm._check_closed():
-                self.disconnect()
-                self.__pool.get_stream(scallback)
-            else:
-                self.__last_checkout = t
+        if not self.__compressors:
+            self.__connect_to(address, callback)
+            return
+
+        def on_channel(strm):
+            if isinstance(strm, Exception):
+                callback(strm)
+                return
+
+            def on_ismaster(result):
+                if isinstance(result, Exception):
+                    strm.close()
+                    callback(result)
+                    return
+                for name in result.get("compression") or []:
+                    if name in self.__compressors:
+                        strm.compression = name
+                        break
                 callback(strm)
-  
-        self.__pool.get_stream(scallback)
-        
+
+            self.__ismaster(strm, on_ismaster, self.__network_timeout)
+
+        self.__connect_to(address, on_channel)
+
+    def __pool_for(self, address):
+        """Get the pool for the node at `address`, creating it if need be.
+        """
+        pool = self.__pools.get(address)
+        if pool is None or pool.closed:
+            pool = self.__pools[address] = _Pool(
+                functools.partial(self.__open_channel, address),
+                self.__io_loop,
+                max_size=self.__max_pool_size,
+                min_size=self.__min_pool_size,
+                wait_queue_timeout=self.__wait_queue_timeout,
+                shared=self.__multiplex,
+                max_idle_time=self.__max_idle_time,
+                max_lifetime=self.__max_lifetime)
+        return pool
+
+    def __close_pool(self, address):
+        pool = self.__pools.pop(address, None)
+        if pool is not None:
+            pool.close()
+
+    def __get_io_loop(self):
+        return self.__io_loop or tornado.ioloop.IOLoop.instance()
+
+    def __start(self, strict=False):
+        """Find the primary and start the background checks.
+
+        If `strict`, failing to find the primary raises
+        :class:`~apymongo.errors.AutoReconnect`.
+        """
+        self.__started = True
+        self.__find_master(strict)
+        if self.__idle_check_interval is not None:
+            self.__every(self.__idle_check_interval, Connection.__check_pool)
+        if self.__heartbeat_frequency is not None:
+            self.__every(self.__heartbeat_frequency,
+                         Connection.__check_topology)
+
+    def after_fork(self, io_loop=None):
+        """Start over in a newly forked child process.
+
+        Pools, streams, the topology, any buffered operations and cursors
+        waiting to be killed inherited from the parent are forgotten
+        without being closed, as their sockets and IOLoop still belong to
+        the parent. The connection then binds to `io_loop` (by default the
+        child's :meth:`~tornado.ioloop.IOLoop.instance`) and finds the
+        primary again.
+
+        This is done automatically on the first operation after a fork,
+        but can be called right after forking to rebuild the pools (and
+        warm them up, if asked to) before any requests come in.
+        """
+        self.__pid = os.getpid()
+        self.__io_loop = io_loop
+        self.__generation += 1
+        self.__pools = {}
+        self.__node_states = {}
+        self.__buffered = collections.deque()
+        self.__reconnect_timeout = None
+        self.__reconnect_attempts = 0
+        self.__encode_times = {}
+        self.__in_flight = {}
+        self.__admission_queues = {}
+        self.__breakers = {}
+        # The parent's operations and cursors are nothing to do with us.
+        if self.__metrics is not None:
+            self.__metrics.in_flight.clear()
+        self.__cursor_manager.forget()
+        self.__set_primary(None)
+        self.__ready = self.__warming = False
+        self.__ready_error = None
+        if self.__started:
+            self.__start()
+
+    def __every(self, interval, func):
+        """Call ``func(self)`` every `interval` seconds for as long as this
+        Connection is around (and hasn't been restarted by
+        :meth:`after_fork`).
+        """
+        # Only hold a weak reference so the scheduled calls don't keep an
+        # otherwise unused Connection alive forever.
+        ref = weakref.ref(self)
+        generation = self.__generation
+
+        def run():
+            connection = ref()
+            if (connection is not None and
+                connection.__generation == generation):
+                func(connection)
+                connection.__get_io_loop().add_timeout(time.time() + interval,
+                                                       run)
+
+        self.__get_io_loop().add_timeout(time.time() + interval, run)
+
+    def __check_pool(self):
+        """Ping idle channels and evict dead, idle or expired ones.
+        """
+        idle_since = time.time() - self.__idle_check_interval
+        for pool in self.__pools.values():
+            pool.check(self.__ping, idle_since)
+
+    def __ping(self, strm, callback):
+        """Check that `strm` is alive, giving up on it if it doesn't
+        answer before the next round of checks.
+        """
+        self.__verify(strm, callback, self.__idle_check_interval)
+
+    def __stream(self, callback, address=None, read_preference=None,
+                 dedicated=False, deadline=None):
+        """Check a channel out of the pool for the node at `address`.
+
+        If `address` is ``None`` the node is chosen according to
+        `read_preference`, which defaults to the primary. If a primary is
+        needed but none is known the request is buffered until one is.
+
+        Dead channels are found and discarded in the background (see
+        :meth:`__check_pool`) so that is not done here, on the request
+        path.
+
+        The channel is authenticated with any credentials registered by
+        :meth:`~apymongo.database.Database.authenticate` before it is
+        handed over.
+
+        When multiplexing the channel may be shared with other
+        outstanding requests, unless it is `dedicated` (see
+        :meth:`_Pool.checkout`). Either way it must be handed back with
+        :meth:`__checkin` once the operation is done with it.
+
+        An operation still waiting (for a primary, to be admitted or for
+        a channel) at `deadline` fails with
+        :class:`~apymongo.errors.NetworkTimeout`.
+        """
+        if self.__pid != os.getpid():
+            self.after_fork()
+        if self.__lazy:
+            self.__lazy = False
+            self.__start()
+
+        if address is None and read_preference not in (None,
+                                                       ReadPreference.PRIMARY):
+            nodes = [node for node in self.__node_states.values()
+                     if self.__available(node.address)]
+            node = read_preferences.select_node(read_preference, nodes,
+                                                self.__latency_window)
+            if node is not None:
+                address = node.address
+            elif read_preference == ReadPreference.SECONDARY:
+                callback(AutoReconnect("no secondary available"))
+                return
+
+        if address is None:
+            if self.__host is None:
+                self.__buffer(callback, read_preference, dedicated,
+                              deadline)
+                return
+            address = (self.__host, self.__port)
+
+        breaker = self.__breakers.get(address)
+        if breaker is not None and not breaker.allow():
+            callback(AutoReconnect("not sending to %r, which keeps failing" %
+                                   (address,)))
+            return
+
+        def checkout():
+            self.__pool_for(address).checkout(
+                functools.partial(self.__prepare, callback, requested,
+                                  address), dedicated, deadline)
+
+        requested = time.time()
+        self.__admit(address, checkout, callback, deadline)
+
+    def __available(self, address):
+        breaker = self.__breakers.get(address)
+        return breaker is None or breaker.available()
+
+    def __record_outcome(self, address, result):
+        """Feed the result of an operation on `address` to its breaker.
+        Only failures to reach the node count against it.
+        """
+        if self.__breaker_threshold is None:
+            return
+        breaker = self.__breakers.get(address)
+        if isinstance(result, AutoReconnect):
+            if breaker is None:
+                breaker = self.__breakers[address] = _CircuitBreaker(
+                    self.__breaker_threshold, self.__breaker_reset_timeout)
+            breaker.failed()
+        elif breaker is not None:
+            breaker.succeeded()
+
+    def __admit(self, address, proceed, callback, deadline=None):
+        """Call `proceed` once `address` has fewer than `max_in_flight`
+        operations outstanding, or fail `callback` with
+        :class:`~apymongo.errors.OverloadedError` if too many are already
+        waiting for that (or with
+        :class:`~apymongo.errors.NetworkTimeout` if still waiting at
+        `deadline`).
+        """
+        if self.__max_in_flight is None:
+            proceed()
+            return
+        count = self.__in_flight.get(address, 0)
+        if count < self.__max_in_flight:
+            self.__in_flight[address] = count + 1
+            proceed()
+            return
+        queue = self.__admission_queues.get(address)
+        if queue is None:
+            queue = self.__admission_queues[address] = collections.deque()
+        if len(queue) >= self.__max_in_flight_queue:
+            callback(OverloadedError("%d operations in flight to %r and %d "
+                                     "waiting" % (count, address, len(queue))))
+            return
+        entry = [proceed, None]
+        if deadline is not None:
+            def on_timeout():
+                queue.remove(entry)
+                callback(NetworkTimeout("timed out waiting for fewer "
+                                        "operations in flight to %r" %
+                                        (address,)))
+
+            entry[1] = self.__get_io_loop().add_timeout(deadline, on_timeout)
+        queue.append(entry)
+
+    def __release(self, address):
+        """An operation admitted by :meth:`__admit` is done: let the next
+        one waiting for `address` go ahead in its place.
+        """
+        if self.__max_in_flight is None:
+            return
+        queue = self.__admission_queues.get(address)
+        if queue:
+            (proceed, timeout) = queue.popleft()
+            if timeout is not None:
+                self.__get_io_loop().remove_timeout(timeout)
+            proceed()
+        elif address in self.__in_flight:
+            self.__in_flight[address] -= 1
+
+    def __in_time(self, strm, deadline):
+        """`strm`, as passed to a :meth:`__stream` callback, unless
+        `deadline` has passed while getting it: then it is checked back
+        in and a :class:`~apymongo.errors.NetworkTimeout` returned
+        instead.
+        """
+        if (deadline is None or isinstance(strm, Exception) or
+            time.time() < deadline):
+            return strm
+        self.__checkin(strm)
+        return NetworkTimeout("no connection to %r in time to send the "
+                              "operation" % (strm.address,))
+
+    def __checkin(self, strm):
+        """Return a channel obtained from :meth:`__stream` to its pool.
+        """
+        strm.pool.checkin(strm)
+        self.__release(strm.address)
 
 
     def disconnect(self):
@@ -618,9 +2198,10 @@ class Connection(object):  # TODO support auth for pooling
         .. seealso:: :meth:`end_request`
         .. versionadded:: 1.3
         """
-        self.__pool = _Pool(self.__connect)
-        self.__host = None
-        self.__port = None
+        for address in self.__pools.keys():
+            self.__close_pool(address)
+        self.__set_primary(None)
+        self.__check_topology()
 
     def set_cursor_manager(self, manager_class):
         """Set this connection's cursor manager.
@@ -673,7 +2254,54 @@ class Connection(object):  # TODO support auth for pooling
         
         return response
 
-    def _send_message(self, message,with_last_error=False,callback=None):
+    def __check_write_reply(self, response, op_type=None):
+        """Check the reply to a write command sent as OP_MSG.
+
+        Returns the reply document, translated for an ``"update"``
+        `op_type` into what getLastError would have said, or an
+        :class:`~apymongo.errors.OperationFailure` for the first document
+        that failed (with the whole reply as its ``details``).
+        """
+        reply = message.unpack_op_msg(response)
+        if not reply.get("ok"):
+            if reply.get("errmsg") == "not master":
+                self.disconnect()
+                return AutoReconnect("not master")
+            return OperationFailure(reply.get("errmsg"), reply.get("code"),
+                                    reply)
+
+        write_errors = reply.get("writeErrors")
+        if write_errors:
+            error = write_errors[0]
+            if error.get("code") in [11000, 11001, 12582]:
+                return DuplicateKeyError(error["errmsg"], error["code"], reply)
+            return OperationFailure(error["errmsg"], error.get("code"), reply)
+
+        concern_error = reply.get("writeConcernError")
+        if concern_error:
+            if concern_error.get("errInfo", {}).get("wtimeout"):
+                return TimeoutError(concern_error["errmsg"],
+                                    concern_error.get("code"), reply)
+            return OperationFailure(concern_error["errmsg"],
+                                    concern_error.get("code"), reply)
+
+        # Look like a getLastError response to existing callers.
+        reply.setdefault("err", None)
+        if op_type == "update":
+            upserted = reply.pop("upserted", None)
+            if upserted:
+                reply["upserted"] = upserted[0]["_id"]
+            reply["updatedExisting"] = bool(reply.get("n") and not upserted)
+        return reply
+
+    def _supports_op_msg(self):
+        """Can writes to the primary be sent as OP_MSG write commands?
+        """
+        node = self.__node_states.get((self.__host, self.__port))
+        return node is not None and node.max_wire_version >= 6
+
+    def _send_message(self, message,with_last_error=False,callback=None,
+                      **kwargs):
         """Say something to Mongo.
 
         Raises ConnectionFailure if the message cannot be sent. Raises
@@ -686,67 +2314,311 @@ class Connection(object):  # TODO support auth for pooling
           - `message`: message to send
           - `with_last_error`: check getLastError status after sending the
             message
+          - `network_timeout` (optional): override the connection's
+            `network_timeout` for getting a stream and the getLastError
+            reply
+          - `_connection_to_use` (optional): address of the node to send
+            the message to, rather than the primary
+          - `_op_type` (optional): what :attr:`metrics` count the
+            message as (``"insert"``, ``"update"``, etc.). Worked out
+            from the message if not given
         """
-
-        
-        def send_callback(strm): 
-            (request_id, data) = message
-            try:
-                strm.write(data)
-            except (ConnectionFailure,socket.error),e:
-                self.disconnect()
-                raise AutoReconnect(str(e)) 
+        (request_id, data) = message
+        timeout = kwargs.get("network_timeout", self.__network_timeout)
+        address = kwargs.get("_connection_to_use")
+        op_type = kwargs.get("_op_type")
+        requested = time.time()
+        deadline = _deadline(requested, timeout)
+
+        def send_callback(strm):
+            strm = self.__in_time(strm, deadline)
+            if isinstance(strm,Exception):
+                self.__unsent(request_id, data, address, None, requested,
+                              strm)
+                if callback:
+                    callback(strm)
+            elif with_last_error:
+                if _HEADER.unpack_from(data)[3] == OP_MSG:
+                    check = functools.partial(self.__check_write_reply,
+                                              op_type=op_type or
+                                              _op_type(data))
+                else:
+                    check = self.__check_response_to_last_error
+                self.__send_and_receive(message,
+                                        callback or (lambda resp: None),
+                                        _remaining(deadline), check, strm,
+                                        op_type=op_type)
             else:
-                if with_last_error:
-                    assert callback != None
-                    def mod_callback(resp):
-                        resp = self.__check_response_to_last_error(resp)
-                        callback(resp)
-                        
-                    self.__receive_message_on_stream(1,request_d,strm,callback=mod_callback)
-                elif callback:
-                     callback(None)
-    
+                if self.__metrics is not None:
+                    self.__metrics.started(strm.address,
+                                           op_type or _op_type(data), False)
+                if self.__listeners:
+                    durations = self.__publish_started(strm, request_id,
+                                                       data)
+                    started = time.time()
+                if self.__coalesce_writes:
+                    strm.write_later(self.__wire(strm, data),
+                                     self.__max_coalesced_bytes)
+                else:
+                    strm.send(request_id, self.__wire(strm, data))
+                self.__checkin(strm)
+                if self.__listeners:
+                    durations["write"] = time.time() - started
+                    self.__publish_finished(strm, request_id, data,
+                                            durations, None)
+                if callback:
+                    callback(None)
              
-        self.__stream(send_callback)
+        self.__stream(send_callback, address, deadline=deadline)
         
 
-    def __receive_message_on_stream(self, operation, request_id, strm,callback):
-        """Receive a message in response to `request_id` on `sock`.
-
-        Returns the response data with the header removed.
+    def __send_and_receive(self, message, callback, timeout, decode, strm,
+                           exhaust=False, op_type=None):
+        """Send a message on the given channel and pass the response to
+        `callback`.
+
+        The response is passed through `decode` (if it isn't ``None``)
+        before being handed over; any
+        :class:`~apymongo.errors.AutoReconnect` or
+        :class:`~apymongo.errors.OperationFailure` raised doing so is
+        passed to `callback` instead. For an `exhaust` query every reply
+        the server streams back is, and the operation finishes with the
+        last one. `op_type` is what :attr:`metrics` count it as.
         """
-     
-        receive_body_curry = functools.partial(receive_body_on_stream,operation,request_id,strm,callback)
-        strm.read_bytes(16,receive_body_curry)
-        
-        
+        (request_id, data) = message        
 
-    def __send_and_receive(self, message, callback,strm):
-        """Send a message on the given socket and return the response data.
+        metrics = self.__metrics
+        if metrics is not None:
+            op_type = op_type or _op_type(data)
+            metrics.started(strm.address, op_type)
+        if self.__listeners:
+            durations = self.__publish_started(strm, request_id, data)
+        times = [time.time(), None]
+
+        def mod_callback(resp):
+            received = time.time()
+            last = (not exhaust or isinstance(resp, Exception) or
+                    not _more_to_come(resp))
+            if last:
+                if metrics is not None:
+                    metrics.finished(strm.address, op_type,
+                                     received - times[0])
+                self.__record_outcome(strm.address, resp)
+                self.__checkin(strm)
+            if decode is not None and not isinstance(resp, Exception):
+                try:
+                    resp = decode(resp)
+                except AutoReconnect, e:
+                    self.disconnect()
+                    resp = e
+                except OperationFailure, e:
+                    resp = e
+            if self.__listeners and last:
+                written = times[1] or received
+                durations["write"] = written - times[0]
+                durations["server_wait"] = received - written
+                durations["decode"] = time.time() - received
+                self.__publish_finished(strm, request_id, data, durations,
+                                        resp)
+            callback(resp)
+
+        strm.send(request_id, self.__wire(strm, data), mod_callback, timeout,
+                  exhaust)
+        times[1] = time.time()
+
+    def __wire(self, strm, data):
+        """`data` as it should be written to `strm`: compressed, if the
+        server agreed to that when the stream was opened.
         """
-        (request_id, data) = message        
-        
-        if isinstance(strm,Exception):
-  
-            callback(strm)
-            
-        else:
-        
-            strm.write(data)
-            self.__receive_message_on_stream(1, request_id, strm, callback)
-        
+        if strm.compression:
+            return message.compress(data, self.__zlib_compression_level,
+                                    self.__compression_threshold)
+        return data
+
+    def _send_message_with_response(self, message, callback, _decode=None,
+                                    **kwargs):
+        """Send a message and pass ``(address, response)`` to `callback`,
+        where `response` is the response data with the header removed
+        (passed through `_decode`, if given) and `address` is the node
+        that sent it.
+
+        A `network_timeout` in `kwargs` overrides the connection's
+        default, even if it is ``None``. The message goes to the node at
+        `_connection_to_use` if that is given, and otherwise to one
+        chosen according to `read_preference`. Queries with `_hedge` set
+        may be hedged (see `hedge_percentile`). An `_exhaust` query goes
+        on a stream of its own, and `callback` is called for each batch.
+        `_op_type` is as for :meth:`_send_message`.
+        """
+        timeout = kwargs.get("network_timeout", self.__network_timeout)
+        read_preference = kwargs.get("read_preference")
+        exhaust = kwargs.get("_exhaust", False)
+        op_type = kwargs.get("_op_type")
+
+        if (kwargs.get("_hedge") and self.__hedge_percentile is not None and
+            kwargs.get("_connection_to_use") is None and
+            read_preference not in (None, ReadPreference.PRIMARY)):
+            self.__send_hedged(message, callback, timeout, _decode,
+                               read_preference, op_type)
+            return
 
+        def mod_callback(strm, resp):
+            if isinstance(resp, Exception):
+                callback(resp)
+            else:
+                callback((strm.address, resp))
 
-    def _send_message_with_response(self, message, callback):
+        def send_callback(strm):
+            strm = self.__in_time(strm, deadline)
+            if isinstance(strm, Exception):
+                self.__unsent(message[0], message[1], address,
+                              read_preference, requested, strm)
+                callback(strm)
+                return
+            self.__send_and_receive(message,
+                                    functools.partial(mod_callback, strm),
+                                    _remaining(deadline), _decode, strm,
+                                    exhaust, op_type)
+                     
+        address = kwargs.get("_connection_to_use")
+        requested = time.time()
+        deadline = _deadline(requested, timeout)
+        self.__stream(send_callback, address, read_preference, exhaust,
+                      deadline)
+
+    def __send_hedged(self, message, callback, timeout, decode,
+                      read_preference, op_type):
+        """Send the query `message` to a node chosen by `read_preference`
+        and, if it is slow to answer, to a second one too.
+
+        "Slow" is the `hedge_percentile` of the latency of earlier
+        queries on the same collection. The first successful reply is
+        passed to `callback`; the other is read and dropped, and any
+        cursor it opened is killed. An error is only passed on if there
+        is no other query still outstanding.
         """
+        namespace = _namespace(message[1])
+        histogram = self.__hedge_latency.get(namespace)
+        if histogram is None:
+            histogram = self.__hedge_latency[namespace] = _Histogram()
+
+        nodes = [node for node in self.__node_states.values()
+                 if self.__available(node.address)]
+        first = read_preferences.select_node(read_preference, nodes,
+                                             self.__latency_window)
+        if first is None:
+            self._send_message_with_response(message, callback,
+                                             _decode=decode,
+                                             network_timeout=timeout,
+                                             read_preference=read_preference,
+                                             _op_type=op_type)
+            return
+
+        state = {"done": False, "outstanding": 0, "timeout": None}
+        started = time.time()
+
+        def on_reply(address, resp):
+            state["outstanding"] -= 1
+            if state["done"]:
+                if not isinstance(resp, Exception):
+                    cursor_id = resp[1].get("cursor_id")
+                    if cursor_id:
+                        self.kill_cursors([cursor_id], address)
+                return
+            if isinstance(resp, Exception):
+                if state["outstanding"]:
+                    return
+            else:
+                histogram.record(time.time() - started)
+            state["done"] = True
+            if state["timeout"] is not None:
+                self.__get_io_loop().remove_timeout(state["timeout"])
+            callback(resp)
+
+        def send(address):
+            state["outstanding"] += 1
+            self._send_message_with_response(
+                message, functools.partial(on_reply, address),
+                _decode=decode, network_timeout=timeout,
+                _connection_to_use=address, _op_type=op_type)
+
+        def hedge():
+            state["timeout"] = None
+            if state["done"]:
+                return
+            others = [node for node in self.__node_states.values()
+                      if node.address != first.address and
+                      self.__available(node.address)]
+            second = read_preferences.select_node(read_preference, others,
+                                                  self.__latency_window)
+            if second is not None:
+                if self.__metrics is not None:
+                    self.__metrics.hedged += 1
+                send(second.address)
+
+        send(first.address)
+        if histogram.count >= _HEDGE_MIN_SAMPLES and not state["done"]:
+            delay = histogram.percentile(self.__hedge_percentile)
+            if delay != float("inf"):
+                state["timeout"] = self.__get_io_loop().add_timeout(
+                    time.time() + delay, hedge)
+
+    def _encode(self, build, *args):
+        """Build a message with ``build(*args)``, timing it if anyone is
+        listening for events.
         """
-           
-        send_callback = functools.partial(self.__send_and_receive,message,callback)
-                     
-        self.__stream(send_callback)
+        if not self.__listeners:
+            return build(*args)
+        started = time.time()
+        message = build(*args)
+        self.__encode_times[message[0]] = time.time() - started
+        return message
+
+    def add_event_listener(self, listener):
+        """Register an :class:`~apymongo.monitoring.OperationListener`.
+        """
+        self.__listeners.append(listener)
 
-                               
+    def __publish_started(self, strm, request_id, data):
+        """Tell listeners an operation is about to be written to `strm`,
+        returning the durations so far for :meth:`__publish_finished`.
+        """
+        durations = {"pool_wait": strm.checkout_wait,
+                     "encode": self.__encode_times.pop(request_id, None)}
+        event = OperationEvent(data, request_id, strm.address,
+                               dict(durations))
+        for listener in self.__listeners:
+            listener.started(event)
+        return durations
+
+    def __unsent(self, request_id, data, address, read_preference,
+                 requested, error):
+        """An operation requested at `requested` failed with `error` before
+        it got a stream: the pool was exhausted or the node overloaded,
+        failing or never found. Tell listeners, blaming the wait for a
+        stream.
+        """
+        encode = self.__encode_times.pop(request_id, None)
+        if not self.__listeners:
+            return
+        if (address is None and self.__host is not None and
+            read_preference in (None, ReadPreference.PRIMARY)):
+            address = (self.__host, self.__port)
+        durations = {"pool_wait": time.time() - requested, "encode": encode}
+        event = OperationEvent(data, request_id, address, durations, error)
+        for listener in self.__listeners:
+            listener.failed(event)
+
+    def __publish_finished(self, strm, request_id, data, durations, result):
+        if isinstance(result, Exception):
+            event = OperationEvent(data, request_id, strm.address, durations,
+                                   result)
+            for listener in self.__listeners:
+                listener.failed(event)
+        else:
+            event = OperationEvent(data, request_id, strm.address, durations)
+            for listener in self.__listeners:
+                listener.succeeded(event)
 
     def start_request(self):
         """DEPRECATED all operations will start a request.
@@ -758,25 +2630,11 @@ class Connection(object):  # TODO support auth for pooling
                       DeprecationWarning)
 
     def end_request(self):
-        """Allow this thread's connection to return to the pool.
-
-        Calling :meth:`end_request` allows the :class:`~socket.socket`
-        that has been reserved for this thread to be returned to the
-        pool. Other threads will then be able to re-use that
-        :class:`~socket.socket`. If your application uses many
-        threads, or has long-running threads that infrequently perform
-        MongoDB operations, then judicious use of this method can lead
-        to performance gains. Care should be taken, however, to make
-        sure that :meth:`end_request` is not called in the middle of a
-        sequence of operations in which ordering is important. This
-        could lead to unexpected results.
-
-        One important case is when a thread is dying permanently. It
-        is best to call :meth:`end_request` when you know a thread is
-        finished, as otherwise its :class:`~socket.socket` will not be
-        reclaimed.
+        """DEPRECATED streams are returned to the pool as soon as each
+        operation is done with them.
         """
-        self.__pool.return_stream()
+        warnings.warn("the Connection.end_request method is deprecated",
+                      DeprecationWarning)
 
     def __cmp__(self, other):
         if isinstance(other, Connection):
@@ -788,7 +2646,7 @@ class Connection(object):  # TODO support auth for pooling
         if len(self.__nodes) == 1:
             return "Connection(%r, %r)" % (self.__host, self.__port)
         else:
-            return "Connection(%r)" % ["%s:%d" % n for n in self.__nodes]
+            return "Connection(%r)" % [_node_to_str(n) for n in self.__nodes]
 
     def __getattr__(self, name):
         """Get a database by name.
@@ -812,7 +2670,7 @@ class Connection(object):  # TODO support auth for pooling
         """
         return self.__getattr__(name)
 
-    def close_cursor(self, cursor_id):
+    def close_cursor(self, cursor_id, address=None):
         """Close a single database cursor.
 
         Raises :class:`TypeError` if `cursor_id` is not an instance of
@@ -821,6 +2679,8 @@ class Connection(object):  # TODO support auth for pooling
 
         :Parameters:
           - `cursor_id`: id of cursor to close
+          - `address` (optional): the node the cursor lives on, if it
+            isn't the primary
 
         .. seealso:: :meth:`set_cursor_manager` and
            the :mod:`~pymongo.cursor_manager` module
@@ -828,9 +2688,9 @@ class Connection(object):  # TODO support auth for pooling
         if not isinstance(cursor_id, (int, long)):
             raise TypeError("cursor_id must be an instance of (int, long)")
 
-        self.__cursor_manager.close(cursor_id)
+        self.__cursor_manager.close(cursor_id, address)
 
-    def kill_cursors(self, cursor_ids):
+    def kill_cursors(self, cursor_ids, address=None):
         """Send a kill cursors message with the given ids.
 
         Raises :class:`TypeError` if `cursor_ids` is not an instance of
@@ -838,10 +2698,14 @@ class Connection(object):  # TODO support auth for pooling
 
         :Parameters:
           - `cursor_ids`: list of cursor ids to kill
+          - `address` (optional): the node the cursors live on, if it
+            isn't the primary
         """
         if not isinstance(cursor_ids, list):
             raise TypeError("cursor_ids must be a list")
-        self._send_message(message.kill_cursors(cursor_ids))
+        self._send_message(message.kill_cursors(cursor_ids),
+                           _connection_to_use=address,
+                           _op_type="killcursors")
 
     def server_info(self,callback):
         """Get information about the MongoDB server we're connected to.
@@ -15,19 +15,21 @@
 """Cursor class to iterate over Mongo query results."""
 
 import functools
+import time
 
 from bson.code import Code
 from bson.son import SON
 from apymongo import (helpers,
                      message)
-from apymongo.errors import (InvalidOperation,
-                            AutoReconnect)
+from apymongo.errors import InvalidOperation
+from apymongo.read_preferences import ReadPreference
 
 _QUERY_OPTIONS = {
     "tailable_cursor": 2,
     "slave_okay": 4,
     "oplog_replay": 8,
-    "no_timeout": 16}
+    "no_timeout": 16,
+    "exhaust": 64}
 
 
 # TODO might be cool to be able to do find().include("foo") or
@@ -51,6 +53,11 @@ class Cursor(object):
                  max_scan=None, 
                  as_class=None,
                  store = True,
+                 read_preference=None,
+                 prefetch=False,
+                 target_batch_bytes=None,
+                 target_batch_time=None,
+                 exhaust=False,
                  _must_use_master=False, 
                  _is_command=False,
                  **kwargs):
@@ -80,6 +87,8 @@ class Cursor(object):
             raise TypeError("snapshot must be an instance of bool")
         if not isinstance(tailable, bool):
             raise TypeError("tailable must be an instance of bool")
+        if not isinstance(exhaust, bool):
+            raise TypeError("exhaust must be an instance of bool")
 
         if fields is not None:
             if not fields:
@@ -90,6 +99,11 @@ class Cursor(object):
         if as_class is None:
             as_class = collection.database.connection.document_class
 
+        if _must_use_master:
+            read_preference = ReadPreference.PRIMARY
+        elif read_preference is None:
+            read_preference = collection.database.connection.read_preference
+
         self.__collection = collection
         self.__callback = callback
         self.__processor = processor
@@ -112,13 +126,24 @@ class Cursor(object):
         self.__as_class = as_class
         self.__tz_aware = collection.database.connection.tz_aware
         self.__must_use_master = _must_use_master
+        self.__read_preference = read_preference
         self.__is_command = _is_command
+        self.__prefetch = prefetch
+        self.__target_batch_bytes = target_batch_bytes
+        self.__target_batch_time = target_batch_time
+        self.__exhaust = exhaust
 
         self.__data = []
         self.__datastore = []
         self.__connection_id = None
         self.__retrieved = 0
         self.__killed = False
+        self.__fetching = False
+        self.__looping = False
+        self.__on_batch = None
+        self.__paused = False
+        self.__reply_size = 0
+        self.__handed_over = None
 
         # this is for passing network_timeout through if it's specified
         # need to use kwargs as None is a legit value for network_timeout
@@ -162,9 +187,20 @@ class Cursor(object):
         unevaluated, even if the current instance has been partially or
         completely evaluated.
         """
-        copy = Cursor(self.__collection, self.__spec, self.__fields,
-                      self.__skip, self.__limit, self.__timeout,
-                      self.__tailable, self.__snapshot)
+        copy = Cursor(self.__collection, callback=self.__callback,
+                      processor=self.__processor, spec=self.__spec,
+                      fields=self.__fields, skip=self.__skip,
+                      limit=self.__limit, timeout=self.__timeout,
+                      snapshot=self.__snapshot, tailable=self.__tailable,
+                      max_scan=self.__max_scan, as_class=self.__as_class,
+                      store=self.__store,
+                      read_preference=self.__read_preference,
+                      prefetch=self.__prefetch,
+                      target_batch_bytes=self.__target_batch_bytes,
+                      target_batch_time=self.__target_batch_time,
+                      exhaust=self.__exhaust,
+                      _must_use_master=self.__must_use_master,
+                      _is_command=self.__is_command, **self.__kwargs)
         copy.__ordering = self.__ordering
         copy.__explain = self.__explain
         copy.__hint = self.__hint
@@ -181,6 +217,9 @@ class Cursor(object):
             else:
                 connection.close_cursor(self.__id)
         self.__killed = True
+        # Whatever is left of an exhaust stream is dropped, so don't wait
+        # for it.
+        self.__fetching = False
 
     def __query_spec(self):
         """Get the spec to use for a query.
@@ -206,10 +245,13 @@ class Cursor(object):
         options = 0
         if self.__tailable:
             options |= _QUERY_OPTIONS["tailable_cursor"]
-        if self.__collection.database.connection.slave_okay:
+        if (self.__read_preference != ReadPreference.PRIMARY or
+            self.__collection.database.connection.slave_okay):
             options |= _QUERY_OPTIONS["slave_okay"]
         if not self.__timeout:
             options |= _QUERY_OPTIONS["no_timeout"]
+        if self.__exhaust:
+            options |= _QUERY_OPTIONS["exhaust"]
         return options
 
     def __check_okay_to_chain(self):
@@ -474,38 +516,119 @@ class Cursor(object):
 
 
 
+    def batches(self, callback):
+        """Stream the results a batch at a time, instead of collecting
+        them all for the cursor's callback.
+
+        `callback` is called with ``(batch, more)`` for each batch, where
+        `batch` is a list of the documents in it (after the cursor's
+        processor, if any) and `more` is a function to call once ready
+        for the next one. Nothing more is fetched until it is called
+        (with `prefetch`, at most one more batch), so memory use is
+        bounded by the batch size rather than the size of the result.
+
+        Once the cursor is exhausted `callback` is called with ``(None,
+        None)``. If a query fails it is called with the exception
+        instead of a batch.
+
+        :Parameters:
+          - `callback`: function taking ``(batch, more)``
+        """
+        self.__on_batch = callback
+        self.loop()
+
+    def __more(self):
+        """Resume a :meth:`batches` cursor once the consumer is ready.
+        """
+        if self.__paused:
+            self.__paused = False
+            (count, size, started) = self.__handed_over
+            self.__adapt(count, size, time.time() - started)
+            self.loop()
+
+    def __adapt(self, count, size, elapsed):
+        """Pick the size of the next batch from how big the last `count`
+        documents were (`size` bytes) and how long they took to process
+        (`elapsed` seconds), if a target for either was given.
+        """
+        estimates = []
+        if self.__target_batch_bytes and size:
+            estimates.append(self.__target_batch_bytes * count // size)
+        if self.__target_batch_time and elapsed > 0:
+            estimates.append(int(self.__target_batch_time * count / elapsed))
+        if estimates:
+            # Grow at most twofold per batch, so that one cheap batch
+            # doesn't send the next one way past the targets. (A batch
+            # size of 1 would close the cursor.)
+            self.__batch_size = max(2, min(min(estimates), 2 * count))
+
     def loop(self):
         
-        if self.__error:
-            self.__callback(self.__error)
+        if self.__looping or self.__paused:
+            # Either a prefetch failed straight away or the consumer of
+            # batches() isn't ready yet; the reply is picked up later.
+            return
+        
+        if len(self.__data) and not self.__error:
             
-        else:
-            if len(self.__data):
-                
-                collection = self.__collection
-                db = collection.database
-                processor = self.__processor
+            (data, self.__data) = (self.__data, [])
+            (size, self.__reply_size) = (self.__reply_size, 0)
+            started = time.time()
+            if self.__prefetch and not self.__killed and not self.__fetching:
+                # Ask for the next batch before processing this one, so
+                # the server fetches it meanwhile.
+                self.__looping = True
+                try:
+                    self._refresh()
+                finally:
+                    self.__looping = False
                 
-                for r in self.__data:
+            collection = self.__collection
+            db = collection.database
+            processor = self.__processor
+            on_batch = self.__on_batch
+            batch = []
+            
+            for r in data:
     
-                    r = db._fix_outgoing(r, collection)
-                   
-                    if processor:
-                        r = processor(r,collection)
-                        
-                    if self.__store and r:
-                        self.__datastore.append(r)
-                        
-                
-                self.__data = []
+                r = db._fix_outgoing(r, collection)
+               
+                if processor:
+                    r = processor(r,collection)
                     
+                if on_batch is not None:
+                    if r:
+                        batch.append(r)
                     
-            if not self.__killed:
-                self._refresh()
-                
+                elif self.__store and r:
+                    self.__datastore.append(r)
+            
+            if batch:
+                self.__paused = True
+                self.__handed_over = (len(data), size, started)
+                on_batch(batch, self.__more)
+                return
+            
+            self.__adapt(len(data), size, time.time() - started)
+            
+        if self.__error:
+            if self.__on_batch is not None:
+                self.__on_batch(self.__error, None)
             else:
+                self.__callback(self.__error)
+            
+        elif self.__fetching:
+            # The prefetched batch calls us back when it arrives.
+            return
                 
-                self.__callback(self.__datastore)
+        elif not self.__killed:
+            self._refresh()
+            
+        elif self.__on_batch is not None:
+            self.__on_batch(None, None)
+            
+        else:
+            self.__callback(self.__datastore)
         
         
 
@@ -518,14 +641,15 @@ class Cursor(object):
         """
 
         callback = self.loop
-        
+        connection = self.__collection.database.connection
         
         if self.__id is None: 
             self.__send_message(
-                message.query(self.__query_options(),
-                              self.__collection.full_name,
-                              self.__skip, self.__limit,
-                              self.__query_spec(), self.__fields),callback)
+                connection._encode(message.query, self.__query_options(),
+                                   self.__collection.full_name,
+                                   self.__skip, self.__limit,
+                                   self.__query_spec(), self.__fields),callback,
+                self.__is_command and "command" or "query")
 
         elif self.__id:  # Get More
             if self.__limit:
@@ -536,36 +660,31 @@ class Cursor(object):
                 limit = self.__batch_size
 
             self.__send_message(
-                message.get_more(self.__collection.full_name,
-                                 limit, self.__id),callback)
+                connection._encode(message.get_more,
+                                   self.__collection.full_name,
+                                   limit, self.__id),callback, "getmore")
 
 
 
-    def __send_message(self, message,callback):
+    def __send_message(self, message,callback, op_type):
         """Send a query or getmore message and handles the response.
+
+        `op_type` is what the connection's metrics count it as.
         """
         db = self.__collection.database
 
         def mod_callback(response):
+            self.__fetching = False
+            
+            if self.__exhaust and self.__killed:
+                # The rest of an exhaust stream we've stopped reading.
+                return
             
             if isinstance(response,Exception):
                 self.__error = response
                       
             else:
-                if isinstance(response, tuple):
-                    (connection_id, response) = response
-                else:
-                    connection_id = None
-        
-                self.__connection_id = connection_id
-        
-                try:
-                    response = helpers._unpack_response(response, self.__id,
-                                                        self.__as_class,
-                                                        self.__tz_aware)
-                except AutoReconnect:
-                    db.connection.disconnect()
-                    raise
+                (self.__connection_id, response) = response
                     
                 self.__id = response["cursor_id"]
                  
@@ -574,9 +693,13 @@ class Cursor(object):
                     assert response["starting_from"] == self.__retrieved
         
                 self.__retrieved += response["number_returned"]
-                self.__data = response["data"]
+                # An exhaust cursor's batches keep coming even while the
+                # consumer of batches() isn't ready, so they pile up.
+                self.__data.extend(response["data"])
+                self.__reply_size += response["size"]
+                self.__fetching = self.__exhaust and self.__id != 0
         
-                die_now = (self.__id == 0) or (len(self.__data) == 0) or (self.__limit and self.__id and self.__limit <= self.__retrieved)
+                die_now = (self.__id == 0) or (len(response["data"]) == 0) or (self.__limit and self.__id and self.__limit <= self.__retrieved)
         
                 if die_now:
                     self.__die()
@@ -585,7 +708,24 @@ class Cursor(object):
             callback()
     
 
-        db.connection._send_message_with_response(message,mod_callback)
+        # getmores have to go to the node the query went to; only the
+        # first batch of a (non-tailable) cursor may be hedged.
+        # The connection decodes the reply, so that it can time that for
+        # event listeners. Errors in it are passed to mod_callback.
+        decode = functools.partial(helpers._unpack_response,
+                                   cursor_id=self.__id,
+                                   as_class=self.__as_class,
+                                   tz_aware=self.__tz_aware)
+
+        self.__fetching = True
+        db.connection._send_message_with_response(message,mod_callback,
+                                                  _decode=decode,
+                                                  read_preference=self.__read_preference,
+                                                  _connection_to_use=self.__connection_id,
+                                                  _hedge=self.__id is None and not self.__tailable and not self.__exhaust,
+                                                  _exhaust=self.__exhaust,
+                                                  _op_type=op_type,
+                                                  **self.__kwargs)
 
 
 
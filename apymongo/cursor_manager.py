@@ -33,18 +33,26 @@ class CursorManager(object):
         """
         self.__connection = connection
 
-    def close(self, cursor_id):
+    def close(self, cursor_id, address=None):
         """Close a cursor by killing it immediately.
 
         Raises TypeError if cursor_id is not an instance of (int, long).
 
         :Parameters:
           - `cursor_id`: cursor id to close
+          - `address` (optional): the node the cursor lives on
         """
         if not isinstance(cursor_id, (int, long)):
             raise TypeError("cursor_id must be an instance of (int, long)")
 
-        self.__connection.kill_cursors([cursor_id])
+        self.__connection.kill_cursors([cursor_id], address)
+
+    def forget(self):
+        """Drop any cursors waiting to be killed, without killing them.
+
+        Called by :meth:`~apymongo.connection.Connection.after_fork`, as
+        the cursors belong to the parent process.
+        """
 
 
 class BatchCursorManager(CursorManager):
@@ -57,7 +65,7 @@ class BatchCursorManager(CursorManager):
         :Parameters:
           - `connection`: a Mongo Connection
         """
-        self.__dying_cursors = []
+        self.__dying_cursors = {}
         self.__max_dying_cursors = 20
         self.__connection = connection
 
@@ -66,21 +74,32 @@ class BatchCursorManager(CursorManager):
     def __del__(self):
         """Cleanup - be sure to kill any outstanding cursors.
         """
-        self.__connection.kill_cursors(self.__dying_cursors)
+        for (address, cursor_ids) in self.__dying_cursors.iteritems():
+            self.__connection.kill_cursors(cursor_ids, address)
 
-    def close(self, cursor_id):
+    def close(self, cursor_id, address=None):
         """Close a cursor by killing it in a batch.
 
+        Cursors are batched per node, since a kill cursors message has to
+        go to the node the cursors live on.
+
         Raises TypeError if cursor_id is not an instance of (int, long).
 
         :Parameters:
           - `cursor_id`: cursor id to close
+          - `address` (optional): the node the cursor lives on
         """
         if not isinstance(cursor_id, (int, long)):
             raise TypeError("cursor_id must be an instance of (int, long)")
 
-        self.__dying_cursors.append(cursor_id)
+        dying = self.__dying_cursors.setdefault(address, [])
+        dying.append(cursor_id)
+
+        if len(dying) > self.__max_dying_cursors:
+            self.__connection.kill_cursors(dying, address)
+            del self.__dying_cursors[address]
 
-        if len(self.__dying_cursors) > self.__max_dying_cursors:
-            self.__connection.kill_cursors(self.__dying_cursors)
-            self.__dying_cursors = []
+    def forget(self):
+        """Drop any cursors waiting to be killed, without killing them.
+        """
+        self.__dying_cursors = {}
@@ -23,8 +23,7 @@ from bson.son import SON
 from apymongo import helpers
 from apymongo.collection import Collection
 from apymongo.errors import (CollectionInvalid,
-                            InvalidName,
-                            OperationFailure)
+                            InvalidName)
 from apymongo.son_manipulator import ObjectIdInjector
 
 
@@ -266,6 +265,8 @@ class Database(object):
             :class:`~pymongo.errors.OperationFailure` if there are any
           - `allowable_errors`: if `check` is ``True``, error messages
             in this list will be ignored by error-checking
+          - `network_timeout` (optional): override the connection's
+            `network_timeout` for this command
           - `**kwargs` (optional): additional keyword arguments will
             be added to the command document before it is sent
 
@@ -282,6 +283,10 @@ class Database(object):
         if isinstance(command, basestring):
             command = SON([(command, value)])
 
+        extra_opts = {}
+        if "network_timeout" in kwargs:
+            extra_opts["network_timeout"] = kwargs.pop("network_timeout")
+
         command.update(kwargs)
 
         if callback:
@@ -302,7 +307,7 @@ class Database(object):
             
         self["$cmd"].find_one(spec_or_id = command,callback=mod_callback,
                                        _must_use_master=True,
-                                       _is_command=True)
+                                       _is_command=True, **extra_opts)
 
   
 
@@ -511,33 +516,20 @@ class Database(object):
         gives access to *all* databases. Effectively, "admin" access
         means root access to the database.
 
-        .. note:: Currently, authentication is per
-           :class:`~socket.socket`. This means that there are a couple
-           of situations in which re-authentication is necessary:
-
-           - On failover (when an
-             :class:`~pymongo.errors.AutoReconnect` exception is
-             raised).
-
-           - After a call to
-             :meth:`~pymongo.connection.Connection.disconnect` or
-             :meth:`~pymongo.connection.Connection.end_request`.
-
-           - When sharing a :class:`~pymongo.connection.Connection`
-             between multiple threads, each thread will need to
-             authenticate separately.
+        The credentials are checked once and then kept by the
+        :class:`~apymongo.connection.Connection`, which authenticates
+        each pooled stream (on every node) the first time it is used.
+        They survive failover and
+        :meth:`~apymongo.connection.Connection.disconnect`.
 
-        .. warning:: Currently, calls to
-           :meth:`~pymongo.connection.Connection.end_request` will
-           lead to unpredictable behavior in combination with
-           auth. The :class:`~socket.socket` owned by the calling
-           thread will be returned to the pool, so whichever thread
-           uses that :class:`~socket.socket` next will have whatever
-           permissions were granted to the calling thread.
+        `callback` is passed ``True`` if authentication succeeded,
+        ``False`` if the credentials were refused, or the error if the
+        server couldn't be reached.
 
         :Parameters:
           - `name`: the name of the user to authenticate
           - `password`: the password of the user to authenticate
+          - `callback` (optional): called with the result
 
         .. mongodoc:: authenticate
         """
@@ -546,31 +538,17 @@ class Database(object):
         if not isinstance(password, basestring):
             raise TypeError("password must be an instance of basestring")
 
-
-        def mod_callback2(result):
-            result = not isinstance(result,OperationFailure)
-            callback(result)
-
-
-        def mod_callback(result):
-            nonce = result["nonce"]
-            
-            key = helpers._auth_key(nonce, name, password)
-            
-            self.command("authenticate",callback = mod_callback2, user=unicode(name),
-                             nonce=nonce, key=key)
-            
-
-        self.command("getnonce",callback=mod_callback)        
-
+        self.__connection._authenticate(self.__name, name, password,
+                                        callback)
 
 
     def logout(self):
         """Deauthorize use of this database for this connection.
 
-        Note that other databases may still be authorized.
+        Note that other databases may still be authorized. Each pooled
+        stream logs out the next time it is used.
         """
-        self.command("logout")
+        self.__connection._logout(self.__name)
 
     def dereference(self, dbref,callback):
         """Dereference a :class:`~bson.dbref.DBRef`, getting the
@@ -41,6 +41,25 @@ class AutoReconnect(ConnectionFailure):
     """
 
 
+class NetworkTimeout(AutoReconnect):
+    """Raised when the server doesn't reply to an operation within its
+    `network_timeout`.
+
+    The stream the operation was sent on is no longer used, so as with
+    :class:`AutoReconnect` the operation may or may not have succeeded.
+    """
+
+
+class OverloadedError(PyMongoError):
+    """Raised when an operation is refused because the node it would go to
+    already has `max_in_flight` operations outstanding and
+    `max_in_flight_queue` more waiting to start.
+
+    The operation was never sent. Retrying right away is likely to fail
+    the same way.
+    """
+
+
 class ConfigurationError(PyMongoError):
     """Raised when something is incorrectly configured.
     """
@@ -49,12 +68,17 @@ class ConfigurationError(PyMongoError):
 class OperationFailure(PyMongoError):
     """Raised when a database operation fails.
 
+    For writes sent as OP_MSG, :attr:`details` is the server's reply,
+    whose ``writeErrors`` list has an entry (with its ``index``) for
+    each document that failed.
+
     .. versionadded:: 1.8
        The :attr:`code` attribute.
     """
 
-    def __init__(self, error, code=None):
+    def __init__(self, error, code=None, details=None):
         self.code = code
+        self.details = details
         PyMongoError.__init__(self, error)
 
 
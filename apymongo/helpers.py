@@ -39,7 +39,7 @@ def _index_list(key_or_list, direction=None):
         return [(key_or_list, direction)]
     else:
         if isinstance(key_or_list, basestring):
-            return [(key_or_list, pymongo.ASCENDING)]
+            return [(key_or_list, apymongo.ASCENDING)]
         elif not isinstance(key_or_list, list):
             raise TypeError("if no direction is specified, "
                             "key_or_list must be an instance of list")
@@ -65,13 +65,28 @@ def _index_document(index_list):
     for (key, value) in index_list:
         if not isinstance(key, basestring):
             raise TypeError("first item in each key pair must be a string")
-        if value not in [pymongo.ASCENDING, pymongo.DESCENDING, pymongo.GEO2D]:
+        if value not in [apymongo.ASCENDING, apymongo.DESCENDING,
+                         apymongo.GEO2D]:
             raise TypeError("second item in each key pair must be ASCENDING, "
                             "DESCENDING, or GEO2D")
         index[key] = value
     return index
 
 
+# responseFlags, cursorID, startingFrom, numberReturned
+_REPLY_FIELDS = struct.Struct("<iqii")
+
+
+def _documents(response):
+    """The documents in an OP_REPLY body, for :func:`bson.decode_all`.
+
+    A view on the body rather than a copy of it: the C decoder reads the
+    documents in place. (The pure Python one still copies each document
+    as it parses it.)
+    """
+    return buffer(response, 20)
+
+
 def _unpack_response(response, cursor_id=None, as_class=dict, tz_aware=False):
     """Unpack a response from the database.
 
@@ -85,7 +100,8 @@ def _unpack_response(response, cursor_id=None, as_class=dict, tz_aware=False):
         valid at server response
       - `as_class` (optional): class to use for resulting documents
     """
-    response_flag = struct.unpack("<i", response[:4])[0]
+    (response_flag, cursor_id_returned,
+     starting_from, number_returned) = _REPLY_FIELDS.unpack_from(response)
     if response_flag & 1:
         # Shouldn't get this response if we aren't doing a getMore
         assert cursor_id is not None
@@ -100,10 +116,11 @@ def _unpack_response(response, cursor_id=None, as_class=dict, tz_aware=False):
                                error_object["$err"])
 
     result = {}
-    result["cursor_id"] = struct.unpack("<q", response[4:12])[0]
-    result["starting_from"] = struct.unpack("<i", response[12:16])[0]
-    result["number_returned"] = struct.unpack("<i", response[16:20])[0]
-    result["data"] = bson.decode_all(response[20:], as_class, tz_aware)
+    result["cursor_id"] = cursor_id_returned
+    result["starting_from"] = starting_from
+    result["number_returned"] = number_returned
+    result["size"] = len(response) - 20
+    result["data"] = bson.decode_all(_documents(response), as_class, tz_aware)
     assert len(result["data"]) == result["number_returned"]
     return result
 
@@ -24,6 +24,7 @@ MongoDB.
 
 import random
 import struct
+import zlib
 
 import bson
 from bson.son import SON
@@ -37,6 +38,26 @@ from apymongo.errors import InvalidOperation
 
 __ZERO = "\x00\x00\x00\x00"
 
+OP_COMPRESSED = 2012
+OP_MSG = 2013
+
+# OP_MSG flagBits: the sender expects no reply.
+_MORE_TO_COME = 2
+
+# Compressor ids used in OP_COMPRESSED, by the name used to negotiate them.
+_COMPRESSOR_IDS = {"zlib": 2}
+
+_HEADER = struct.Struct("<iiii")
+# originalOpcode, uncompressedSize, compressorId
+_COMPRESSED = struct.Struct("<iiB")
+
+# Commands that are never compressed: the handshake that agrees on
+# compression, and anything carrying credentials.
+_NO_COMPRESSION = frozenset(["ismaster", "isMaster", "getnonce",
+                             "authenticate", "saslStart", "saslContinue",
+                             "copydbgetnonce", "copydbsaslstart", "copydb",
+                             "createUser", "updateUser"])
+
 
 def __last_error(args):
     """Data to send to do a lastError.
@@ -59,6 +80,70 @@ def __pack_message(operation, data):
     return (request_id, message + data)
 
 
+def _command_name(data, position, operation):
+    """The name of the command in the OP_QUERY or OP_MSG message at
+    `position` in `data`, or ``None`` if it isn't a command.
+    """
+    if operation == 2004:
+        # The namespace follows the header and flags, and the query
+        # document follows the namespace, skip and limit.
+        end = data.index("\x00", position + 20)
+        if data[end - 5:end] != ".$cmd":
+            return None
+        start = end + 1 + 8 + 5
+    elif operation == OP_MSG:
+        # The document in the first section follows the header, the
+        # flags and the section kind.
+        start = position + 21 + 5
+    else:
+        return None
+    return data[start:data.index("\x00", start)]
+
+
+def compress(data, level=-1, threshold=0):
+    """Wrap each message in `data` that is at least `threshold` bytes long
+    in an OP_COMPRESSED message, compressed with zlib at `level`.
+
+    `data` may hold several messages back to back (a write followed by a
+    getLastError, say). Each keeps its request id. Handshake and
+    authentication commands are left as they are.
+    """
+    pieces = []
+    position = 0
+    while position < len(data):
+        (length, request_id, response_to,
+         operation) = _HEADER.unpack_from(data, position)
+        if (length < threshold or
+            _command_name(data, position, operation) in _NO_COMPRESSION):
+            pieces.append(data[position:position + length])
+        else:
+            body = zlib.compress(data[position + 16:position + length],
+                                 level)
+            pieces.append(_HEADER.pack(16 + _COMPRESSED.size + len(body),
+                                       request_id, response_to,
+                                       OP_COMPRESSED))
+            pieces.append(_COMPRESSED.pack(operation, length - 16,
+                                           _COMPRESSOR_IDS["zlib"]))
+            pieces.append(body)
+        position += length
+    return "".join(pieces)
+
+
+def decompress(body):
+    """Get the original body of an OP_COMPRESSED message from its `body`.
+
+    Raises :class:`ValueError` if it wasn't compressed with zlib or
+    doesn't decompress to the size it should.
+    """
+    (_, size, compressor_id) = _COMPRESSED.unpack_from(body)
+    if compressor_id != _COMPRESSOR_IDS["zlib"]:
+        raise ValueError("unsupported compressor id %d" % compressor_id)
+    data = zlib.decompress(buffer(body, _COMPRESSED.size))
+    if len(data) != size:
+        raise ValueError("compressed message has the wrong size")
+    return data
+
+
 def insert(collection_name, docs, check_keys, safe, last_error_args):
     """Get an **insert** message.
     """
@@ -145,6 +230,69 @@ def delete(collection_name, spec, safe, last_error_args):
         return __pack_message(2006, data)
 
 
+def __op_msg(collection_name, command_name, identifier, docs, check_keys,
+             safe, last_error_args):
+    """Get an OP_MSG running write command `command_name` on
+    `collection_name`, with `docs` in a document sequence called
+    `identifier`.
+
+    Unacknowledged writes set moreToCome, so the server doesn't reply.
+    """
+    (db, collection) = collection_name.split(".", 1)
+    command = SON([(command_name, collection), ("ordered", True)])
+    if not safe:
+        command["writeConcern"] = {"w": 0}
+    elif last_error_args:
+        command["writeConcern"] = SON(last_error_args)
+    command["$db"] = db
+
+    documents = "".join([bson.BSON.encode(doc, check_keys) for doc in docs])
+    if not documents:
+        raise InvalidOperation("cannot do an empty bulk %s" % command_name)
+    identifier = bson._make_c_string(identifier)
+
+    data = struct.pack("<I", not safe and _MORE_TO_COME or 0)
+    data += "\x00" + bson.BSON.encode(command)
+    data += "\x01" + struct.pack("<i", 4 + len(identifier) + len(documents))
+    data += identifier + documents
+    return __pack_message(OP_MSG, data)
+
+
+def insert_op_msg(collection_name, docs, check_keys, safe, last_error_args):
+    """Get an OP_MSG **insert** command, with `docs` in a document
+    sequence.
+    """
+    return __op_msg(collection_name, "insert", "documents", docs,
+                    check_keys, safe, last_error_args)
+
+
+def update_op_msg(collection_name, upsert, multi, spec, doc, safe,
+                  last_error_args):
+    """Get an OP_MSG **update** command.
+    """
+    update = SON([("q", spec), ("u", doc),
+                  ("upsert", upsert), ("multi", multi)])
+    return __op_msg(collection_name, "update", "updates", [update],
+                    False, safe, last_error_args)
+
+
+def delete_op_msg(collection_name, spec, safe, last_error_args):
+    """Get an OP_MSG **delete** command.
+    """
+    delete = SON([("q", spec), ("limit", 0)])
+    return __op_msg(collection_name, "delete", "deletes", [delete],
+                    False, safe, last_error_args)
+
+
+def unpack_op_msg(body):
+    """Get the document in the (single, kind 0) section of the OP_MSG
+    reply `body`.
+    """
+    if body[4] != "\x00":
+        raise ValueError("expected a single kind 0 section")
+    return bson.BSON(body[5:]).decode()
+
+
 def kill_cursors(cursor_ids):
     """Get a **killCursors** message.
     """
@@ -0,0 +1,231 @@
+# Copyright 2009-2010 10gen, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Counters and latency histograms kept by a
+:class:`~apymongo.connection.Connection`.
+
+Recording costs a few microseconds per operation (a handful of dict
+updates and two bisects); pass ``metrics=False`` to the
+:class:`~apymongo.connection.Connection` to turn it off. Read the
+numbers with :meth:`Metrics.snapshot` or render them for Prometheus with
+:meth:`Metrics.prometheus`.
+"""
+
+from bisect import bisect_left
+from collections import defaultdict
+import struct
+
+# Histogram bucket upper bounds, in seconds: 100us doubling up to ~13s.
+_BOUNDS = tuple(0.0001 * 2 ** i for i in range(18))
+
+_OPCODE = struct.Struct("<i")
+
+_OP_TYPES = {2001: "update",
+             2002: "insert",
+             2004: "query",
+             2005: "getmore",
+             2006: "delete",
+             2007: "killcursors",
+             2013: "command"}
+
+_WRITE_COMMANDS = ("insert", "update", "delete")
+
+
+def _op_type(data):
+    """The kind of operation the wire protocol message `data` holds.
+
+    Callers that know what they are sending say so instead: this has to
+    scan the message.
+    """
+    op = _OP_TYPES.get(_OPCODE.unpack_from(data, 12)[0], "other")
+    if op == "query":
+        # The namespace follows the header and flags.
+        end = data.index("\x00", 20)
+        if data[end - 5:end] == ".$cmd":
+            return "command"
+    elif op == "command":
+        # OP_MSG: the command name is the first key of the document in
+        # the first section, after the flags, section kind, document
+        # length and element type.
+        end = data.index("\x00", 26)
+        if data[26:end] in _WRITE_COMMANDS:
+            return data[26:end]
+    return op
+
+
+class _Histogram(object):
+    """Counts of observations falling in each of a fixed set of buckets.
+    """
+
+    def __init__(self):
+        self.counts = [0] * (len(_BOUNDS) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def record(self, value):
+        self.counts[bisect_left(_BOUNDS, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def percentile(self, p):
+        """The upper bound of the bucket holding the `p`th percentile, or
+        ``None`` if nothing has been recorded.
+        """
+        if not self.count:
+            return None
+        rank = self.count * p / 100.0
+        seen = 0
+        for (i, count) in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                if i < len(_BOUNDS):
+                    return _BOUNDS[i]
+                return float("inf")
+
+    def summary(self):
+        return {"count": self.count,
+                "sum": self.sum,
+                "p50": self.percentile(50),
+                "p99": self.percentile(99)}
+
+
+def _node_label(address):
+    if address[1] is None:
+        return address[0]
+    return "%s:%s" % address
+
+
+class Metrics(object):
+    """What a :class:`~apymongo.connection.Connection` has been doing.
+
+    Should not be created directly by application developers - see
+    :attr:`~apymongo.connection.Connection.metrics` instead.
+    """
+
+    def __init__(self, pool_gauges=None):
+        self.__pool_gauges = pool_gauges
+        self.checkouts = 0
+        self.checkout_wait = _Histogram()
+        self.bytes_written = 0
+        self.bytes_read = 0
+        self.hedged = 0
+        self.in_flight = defaultdict(int)
+        self.ops = defaultdict(int)
+        self.latency = defaultdict(_Histogram)
+
+    # These run for every operation, so _Histogram.record is inlined.
+
+    def checked_out(self, wait):
+        self.checkouts += 1
+        histogram = self.checkout_wait
+        histogram.counts[bisect_left(_BOUNDS, wait)] += 1
+        histogram.count += 1
+        histogram.sum += wait
+
+    def started(self, address, op, acknowledged=True):
+        """Count an operation of type `op` (``"query"``, ``"insert"``,
+        etc.) sent to `address`.
+        """
+        self.ops[op] += 1
+        if acknowledged:
+            self.in_flight[address] += 1
+
+    def finished(self, address, op, duration):
+        """Record that an operation :meth:`started` on `address` took
+        `duration` seconds to be answered (or to fail).
+        """
+        self.in_flight[address] -= 1
+        histogram = self.latency[op]
+        histogram.counts[bisect_left(_BOUNDS, duration)] += 1
+        histogram.count += 1
+        histogram.sum += duration
+
+    def snapshot(self):
+        """Get the current values as a dict.
+
+        ``nodes`` maps ``"host:port"`` to the number of streams ``open``
+        and ``idle`` in the node's pool and the number of operations
+        ``in_flight`` to it. Latencies are summarized by ``count``,
+        ``sum``, ``p50`` and ``p99`` (in seconds; percentiles are the
+        upper bound of the histogram bucket they fall in). ``hedged``
+        counts the reads also sent to a second node because the first
+        was slow.
+        """
+        nodes = {}
+        for (address, count) in self.in_flight.iteritems():
+            nodes[_node_label(address)] = {"open": 0, "idle": 0,
+                                           "in_flight": count}
+        if self.__pool_gauges is not None:
+            for (address, size, idle) in self.__pool_gauges():
+                node = nodes.setdefault(_node_label(address),
+                                        {"in_flight": 0})
+                node["open"] = size
+                node["idle"] = idle
+
+        return {"pool": {"checkouts": self.checkouts,
+                         "checkout_wait": self.checkout_wait.summary()},
+                "nodes": nodes,
+                "bytes_written": self.bytes_written,
+                "bytes_read": self.bytes_read,
+                "hedged": self.hedged,
+                "ops": dict((op, {"count": count})
+                            for (op, count) in self.ops.iteritems()),
+                "latency": dict((op, histogram.summary())
+                                for (op, histogram)
+                                in self.latency.iteritems())}
+
+    def prometheus(self, prefix="apymongo"):
+        """Render the current values in the Prometheus text format.
+        """
+        snapshot = self.snapshot()
+        lines = []
+
+        def metric(name, kind, samples):
+            lines.append("# TYPE %s_%s %s" % (prefix, name, kind))
+            for (labels, value) in samples:
+                lines.append("%s_%s%s %s" % (prefix, name, labels, value))
+
+        def histogram(name, histograms):
+            lines.append("# TYPE %s_%s histogram" % (prefix, name))
+            for (labels, hist) in histograms:
+                seen = 0
+                for (bound, count) in zip(_BOUNDS + ("+Inf",), hist.counts):
+                    seen += count
+                    lines.append('%s_%s_bucket{%sle="%s"} %d' %
+                                 (prefix, name, labels, bound, seen))
+                braces = labels and "{%s}" % labels.rstrip(",") or ""
+                lines.append("%s_%s_sum%s %r" % (prefix, name, braces,
+                                                 hist.sum))
+                lines.append("%s_%s_count%s %d" % (prefix, name, braces,
+                                                   hist.count))
+
+        metric("pool_checkouts_total", "counter",
+               [("", self.checkouts)])
+        histogram("pool_checkout_wait_seconds",
+                  [("", self.checkout_wait)])
+        for gauge in ("open", "idle", "in_flight"):
+            name = gauge == "in_flight" and "in_flight" or "streams_" + gauge
+            metric(name, "gauge",
+                   [('{node="%s"}' % node, values[gauge])
+                    for (node, values) in sorted(snapshot["nodes"].items())])
+        metric("bytes_written_total", "counter", [("", self.bytes_written)])
+        metric("bytes_read_total", "counter", [("", self.bytes_read)])
+        metric("hedged_reads_total", "counter", [("", self.hedged)])
+        metric("ops_total", "counter",
+               [('{op="%s"}' % op, count)
+                for (op, count) in sorted(self.ops.items())])
+        histogram("op_duration_seconds",
+                  [('op="%s",' % op, hist)
+                   for (op, hist) in sorted(self.latency.items())])
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,102 @@
+# Copyright 2009-2010 10gen, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Listen to the operations a :class:`~apymongo.connection.Connection`
+sends.
+
+Subclass :class:`OperationListener` and pass instances in the
+`event_listeners` parameter to :class:`~apymongo.connection.Connection`
+(or to :meth:`~apymongo.connection.Connection.add_event_listener`).
+When no listener is registered no events are built at all.
+"""
+
+import bson
+from bson.son import SON
+from apymongo.message import OP_MSG
+from apymongo.metrics import (_OPCODE,
+                              _op_type)
+
+
+def _namespace(data):
+    """The namespace of the wire protocol message `data`, or ``None`` if
+    it doesn't have one (kill cursors).
+    """
+    if _op_type(data) == "killcursors":
+        return None
+    if _OPCODE.unpack_from(data, 12)[0] == OP_MSG:
+        # The command document follows the flags and the section kind.
+        size = _OPCODE.unpack_from(data, 21)[0]
+        command = bson.BSON(data[21:21 + size]).decode(as_class=SON)
+        return u"%s.%s" % (command["$db"], command.values()[0])
+    # Every other message has an int32 after the header, then the name.
+    end = data.index("\x00", 20)
+    return unicode(data[20:end], "utf-8")
+
+
+class OperationEvent(object):
+    """An operation starting, succeeding or failing.
+
+    - ``op_type``: ``"query"``, ``"getmore"``, ``"insert"``,
+      ``"update"``, ``"delete"``, ``"command"`` or ``"killcursors"``
+    - ``namespace``: the ``"database.collection"`` it applies to
+    - ``request_id``: the id of the message sent
+    - ``address``: the ``(host, port)`` of the node it was sent to (or
+      meant for, if it failed before getting a stream; ``None`` if that
+      node wasn't known)
+    - ``size``: the encoded size of the message, in bytes
+    - ``durations``: a dict of the time spent (in seconds) in each phase
+      so far: ``pool_wait`` for a stream, ``encode`` (if known),
+      ``write`` and, once it has finished, ``server_wait`` for the reply
+      and ``decode``
+    - ``failure``: the exception, for a failed operation
+    """
+
+    def __init__(self, data, request_id, address, durations, failure=None):
+        self.op_type = _op_type(data)
+        self.namespace = _namespace(data)
+        self.request_id = request_id
+        self.address = address
+        self.size = len(data)
+        self.durations = durations
+        self.failure = failure
+
+    def __repr__(self):
+        return "OperationEvent(%r, %r, %r, %r)" % (self.op_type,
+                                                   self.namespace,
+                                                   self.request_id,
+                                                   self.address)
+
+
+class OperationListener(object):
+    """Base class for listeners; override whichever methods you need.
+
+    Each method is passed an :class:`OperationEvent`. Listeners are
+    called on the IOLoop, so they should be quick.
+    """
+
+    def started(self, event):
+        """The operation has been written to a stream."""
+        pass
+
+    def succeeded(self, event):
+        """The operation's reply arrived and was decoded (or, for an
+        unacknowledged write, the operation was written).
+        """
+        pass
+
+    def failed(self, event):
+        """The operation failed; see ``event.failure``. An operation that
+        never got a stream fails without having started.
+        """
+        pass
@@ -0,0 +1,95 @@
+# Copyright 2009-2010 10gen, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tools for choosing which member of a replica set to read from."""
+
+import random
+
+from apymongo.errors import ConfigurationError
+
+
+class ReadPreference:
+    """The read preferences supported by APyMongo.
+
+    - ``PRIMARY``: read from the primary only.
+    - ``PRIMARY_PREFERRED``: read from the primary if it is available,
+      otherwise from a secondary.
+    - ``SECONDARY``: read from a secondary only.
+    - ``SECONDARY_PREFERRED``: read from a secondary if one is available,
+      otherwise from the primary.
+    - ``NEAREST``: read from any available member.
+
+    Whenever more than one member is eligible the read goes to one of
+    those whose measured round trip time is within the connection's
+    `secondary_acceptable_latency_ms` of the fastest one.
+    """
+
+    PRIMARY = 0
+    PRIMARY_PREFERRED = 1
+    SECONDARY = 2
+    SECONDARY_PREFERRED = 3
+    NEAREST = 4
+
+
+_MODES = (ReadPreference.PRIMARY,
+          ReadPreference.PRIMARY_PREFERRED,
+          ReadPreference.SECONDARY,
+          ReadPreference.SECONDARY_PREFERRED,
+          ReadPreference.NEAREST)
+
+
+def validate(mode):
+    """Raise :class:`~apymongo.errors.ConfigurationError` if `mode` isn't
+    one of the :class:`ReadPreference` modes.
+    """
+    if mode not in _MODES:
+        raise ConfigurationError("not a valid read preference: %r" % (mode,))
+    return mode
+
+
+def _nearest(nodes, latency_window):
+    """Pick one of `nodes` at random from those within `latency_window`
+    seconds of the fastest.
+    """
+    if not nodes:
+        return None
+    fastest = min([node.rtt or 0 for node in nodes])
+    near = [node for node in nodes
+            if (node.rtt or 0) <= fastest + latency_window]
+    return random.choice(near)
+
+
+def select_node(mode, nodes, latency_window):
+    """Choose the node a read with read preference `mode` should go to.
+
+    `nodes` are objects with ``up``, ``ismaster``, ``secondary`` and
+    ``rtt`` (seconds) attributes, as kept up to date by the
+    connection's topology monitor. Returns ``None`` if no node is
+    eligible.
+    """
+    primaries = [node for node in nodes if node.up and node.ismaster]
+    secondaries = [node for node in nodes if node.up and node.secondary]
+
+    if mode == ReadPreference.PRIMARY:
+        candidates = primaries
+    elif mode == ReadPreference.PRIMARY_PREFERRED:
+        candidates = primaries or secondaries
+    elif mode == ReadPreference.SECONDARY:
+        candidates = secondaries
+    elif mode == ReadPreference.SECONDARY_PREFERRED:
+        candidates = secondaries or primaries
+    else:
+        candidates = primaries + secondaries
+
+    return _nearest(candidates, latency_window)
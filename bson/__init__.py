@@ -379,8 +379,9 @@ def _to_dicts(data, as_class=dict, tz_aware=True):
 def decode_all(data, as_class=dict, tz_aware=True):
     """Decode BSON data to multiple documents.
 
-    `data` must be a string of concatenated, valid, BSON-encoded
-    documents.
+    `data` must be a string or buffer of concatenated, valid,
+    BSON-encoded documents. The C extension decodes a buffer in place;
+    the pure Python decoder copies each document's bytes as it goes.
 
     :Parameters:
       - `data`: BSON data
@@ -391,10 +392,22 @@ def decode_all(data, as_class=dict, tz_aware=True):
 
     .. versionadded:: 1.9
     """
+    # Walk through by offset rather than re-slicing what is left after
+    # each document, which copies a large batch over and over.
     docs = []
-    while len(data):
-        (doc, data) = _bson_to_dict(data, as_class, tz_aware)
-        docs.append(doc)
+    position = 0
+    end = len(data)
+    while position < end:
+        obj_size = struct.unpack("<i", data[position:position + 4])[0]
+        if obj_size < 5:
+            raise InvalidBSON("objsize too small")
+        if end - position < obj_size:
+            raise InvalidBSON("objsize too large")
+        if data[position + obj_size - 1] != "\x00":
+            raise InvalidBSON("bad eoo")
+        elements = data[position + 4:position + obj_size - 1]
+        docs.append(_elements_to_dict(elements, as_class, tz_aware))
+        position += obj_size
     return docs
 if _use_c:
     decode_all = _cbson.decode_all
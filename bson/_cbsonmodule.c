@@ -1313,13 +1313,22 @@ static PyObject* _cbson_decode_all(PyObject* self, PyObject* args) {
         return NULL;
     }
 
-    if (!PyString_Check(bson)) {
-        PyErr_SetString(PyExc_TypeError, "argument to decode_all must be a string");
-        return NULL;
-    }
-    total_size = PyString_Size(bson);
-    string = PyString_AsString(bson);
-    if (!string) {
+    /* A buffer is read in place, so a reply body needn't be copied out
+     * of the message it came in. */
+    if (PyString_Check(bson)) {
+        total_size = PyString_Size(bson);
+        string = PyString_AsString(bson);
+        if (!string) {
+            return NULL;
+        }
+    } else if (PyBuffer_Check(bson)) {
+        if (PyObject_AsReadBuffer(bson, (const void**)&string,
+                                  &total_size) == -1) {
+            return NULL;
+        }
+    } else {
+        PyErr_SetString(PyExc_TypeError,
+                        "argument to decode_all must be a string or buffer");
         return NULL;
     }
 
@@ -1336,6 +1345,14 @@ static PyObject* _cbson_decode_all(PyObject* self, PyObject* args) {
 
         memcpy(&size, string, 4);
 
+        if (size < 5) {
+            PyObject* InvalidBSON = _error("InvalidBSON");
+            PyErr_SetString(InvalidBSON,
+                            "objsize too small");
+            Py_DECREF(InvalidBSON);
+            return NULL;
+        }
+
         if (total_size < size) {
             PyObject* InvalidBSON = _error("InvalidBSON");
             PyErr_SetString(InvalidBSON,
@@ -16,6 +16,7 @@
 
 import datetime
 import os
+import struct
 import sys
 import time
 import unittest
@@ -26,17 +27,37 @@ from nose.plugins.skip import SkipTest
 
 from tornado.testing import AsyncTestCase
 
+import bson
+from bson import BSON
+from bson.errors import InvalidBSON
+from bson.objectid import ObjectId
 from bson.son import SON
 from bson.tz_util import utc
+from apymongo.collection import _split_points
 from apymongo.connection import (Connection,
+                                _Channel,
+                                _CircuitBreaker,
+                                _Node,
+                                _Pool,
                                 _parse_uri)
+from apymongo import (helpers,
+                      message)
+from apymongo.cursor_manager import BatchCursorManager, CursorManager
 from apymongo.database import Database
 from apymongo.errors import (AutoReconnect,
                             ConfigurationError,
                             ConnectionFailure,
+                            DuplicateKeyError,
                             InvalidName,
                             InvalidURI,
-                            OperationFailure)
+                            NetworkTimeout,
+                            OperationFailure,
+                            OverloadedError)
+from apymongo.metrics import (Metrics,
+                              _Histogram,
+                              _op_type)
+from apymongo.monitoring import OperationListener
+from apymongo.read_preferences import ReadPreference, select_node
 from test import version
 
 
@@ -96,6 +117,35 @@ class TestConnection(unittest.TestCase):
         self.assertEqual(Connection(self.host, self.port).port, self.port)
         self.assertEqual(set([(self.host, self.port)]), Connection(self.host, self.port).nodes)
 
+    def test_parse_unix_socket_uri(self):
+        sock = "/tmp/mongodb-27017.sock"
+        self.assertEqual(([(sock, None)], None, None, None, None, {}),
+                         _parse_uri("mongodb://" + sock))
+        self.assertEqual(([(sock, None)], "db", None, None, "coll", {}),
+                         _parse_uri("mongodb://%s/db.coll" % sock))
+        self.assertEqual(([(sock, None)], "db", "u", "p", None, {}),
+                         _parse_uri("mongodb://u:p@%2Ftmp%2Fmongodb-27017.sock"
+                                    "/db"))
+        self.assertRaises(InvalidURI, _parse_uri, "mongodb:///tmp/mongodb")
+
+        # Only a lone socket path ending at its first .sock goes unencoded.
+        for uri in ["mongodb://u:p@/tmp/mongodb-27017.sock/db",
+                    "mongodb:///tmp/a.sock,/tmp/b.sock",
+                    "mongodb:///tmp/x.socks/mongodb-27017.sock",
+                    "mongodb:///tmp/x.sock/mongodb-27017.sock/db"]:
+            self.assertRaises(InvalidURI, _parse_uri, uri)
+        self.assertEqual(([("/tmp/a.sock", None), ("/tmp/b.sock", None)],
+                          None, None, None, None, {}),
+                         _parse_uri("mongodb://%2Ftmp%2Fa.sock,"
+                                    "%2Ftmp%2Fb.sock"))
+        self.assertEqual(([("/tmp/x.sock/mongodb-27017.sock", None)],
+                          "db", None, None, None, {}),
+                         _parse_uri("mongodb://%2Ftmp%2Fx.sock%2F"
+                                    "mongodb-27017.sock/db"))
+        self.assertEqual(([(sock, None)], "db", None, None, None,
+                          {"w": "1"}),
+                         _parse_uri("mongodb://%s/db?w=1" % sock))
+
     def test_get_db(self):
         connection = Connection(self.host, self.port)
 
@@ -114,6 +164,1340 @@ class TestConnection(unittest.TestCase):
         self.assertEqual(connection.test, Database(connection, "test"))
         
 
+class _FakeIOLoop(object):
+
+    def __init__(self):
+        self.timeouts = []
+        self.callbacks = []
+
+    def add_callback(self, callback):
+        self.callbacks.append(callback)
+
+    def add_timeout(self, deadline, callback):
+        timeout = [deadline, callback]
+        self.timeouts.append(timeout)
+        return timeout
+
+    def remove_timeout(self, timeout):
+        if timeout in self.timeouts:
+            self.timeouts.remove(timeout)
+
+    def fire_timeouts(self):
+        timeouts, self.timeouts = self.timeouts, []
+        for (_, callback) in timeouts:
+            callback()
+
+
+class _FakeStream(object):
+    """Just enough of an IOStream to drive a _Channel by hand."""
+
+    def __init__(self):
+        self.io_loop = _FakeIOLoop()
+        self.written = []
+        self.write_callbacks = []
+        self.reads = []
+        self.close_callback = None
+        self.is_closed = False
+
+    def set_close_callback(self, callback):
+        self.close_callback = callback
+
+    def write(self, data, callback=None):
+        self.written.append(data)
+        if callback is not None:
+            self.write_callbacks.append(callback)
+
+    def read_bytes(self, num_bytes, callback):
+        self.reads.append((num_bytes, callback))
+
+    def closed(self):
+        return self.is_closed
+
+    def close(self):
+        self.is_closed = True
+        self.close_callback()
+
+    def reply(self, response_to, body, operation=1, request_id=0):
+        (num_bytes, callback) = self.reads.pop(0)
+        assert num_bytes == 16
+        callback(struct.pack("<iiii", 16 + len(body), request_id,
+                             response_to, operation))
+        (num_bytes, callback) = self.reads.pop(0)
+        assert num_bytes == len(body)
+        callback(body)
+
+
+class TestChannel(unittest.TestCase):
+
+    def test_replies_routed_by_response_to(self):
+        stream = _FakeStream()
+        channel = _Channel(stream)
+        results = {}
+
+        channel.send(1, "first", lambda r: results.__setitem__(1, r))
+        channel.send(2, "second", lambda r: results.__setitem__(2, r))
+        channel.send(3, "unacknowledged")
+        self.assertEqual(["first", "second", "unacknowledged"],
+                         stream.written)
+        self.assertEqual(1, len(stream.reads))
+
+        stream.reply(2, "reply to 2")
+        self.assertEqual({2: "reply to 2"}, results)
+        stream.reply(1, "reply to 1")
+        self.assertEqual({1: "reply to 1", 2: "reply to 2"}, results)
+        self.assertFalse(channel.pending)
+        self.assertFalse(stream.reads)
+
+    def test_close_fails_pending(self):
+        stream = _FakeStream()
+        channel = _Channel(stream)
+        results = []
+
+        channel.send(1, "first", results.append)
+        channel.send(2, "second", results.append)
+        stream.close()
+        self.assertEqual(2, len(results))
+        self.assert_(all(isinstance(r, AutoReconnect) for r in results))
+
+    def test_timeout_quarantines(self):
+        stream = _FakeStream()
+        channel = _Channel(stream)
+        results = []
+
+        channel.send(1, "slow", results.append, timeout=5)
+        channel.send(2, "fast", results.append)
+        self.assertEqual(1, len(stream.io_loop.timeouts))
+
+        stream.io_loop.fire_timeouts()
+        self.assertEqual(1, len(results))
+        self.assert_(isinstance(results[0], NetworkTimeout))
+        self.assert_(channel.closed())
+        self.assertFalse(stream.is_closed)
+
+        stream.reply(2, "reply to 2")
+        self.assertEqual("reply to 2", results[1])
+        self.assert_(stream.is_closed)
+
+    def test_reply_clears_deadline(self):
+        stream = _FakeStream()
+        channel = _Channel(stream)
+        results = []
+
+        channel.send(1, "query", results.append, timeout=5)
+        stream.reply(1, "reply to 1")
+        self.assertEqual(["reply to 1"], results)
+        self.assertFalse(stream.io_loop.timeouts)
+        self.assertFalse(channel.closed())
+
+    def test_compressed_reply(self):
+        stream = _FakeStream()
+        channel = _Channel(stream)
+        results = []
+
+        body = "reply " * 100
+        compressed = message.compress(struct.pack("<iiii", 16 + len(body),
+                                                  0, 1, 1) + body)
+        self.assert_(len(compressed) < 16 + len(body))
+        channel.send(1, "query", results.append)
+        stream.reply(1, compressed[16:], message.OP_COMPRESSED)
+        self.assertEqual([body], results)
+
+    def test_close_writes_queue_first(self):
+        stream = _FakeStream()
+        channel = _Channel(stream)
+
+        channel.write_later("a", 10)
+        channel.close()
+        self.assertEqual(["a"], stream.written)
+        self.assert_(channel.closed())
+        self.assertFalse(stream.is_closed)
+
+        # The stream is closed once the write is done.
+        stream.write_callbacks.pop()()
+        self.assert_(stream.is_closed)
+        for callback in stream.io_loop.callbacks:
+            callback()
+        self.assertEqual(["a"], stream.written)
+
+    def test_exhaust(self):
+        stream = _FakeStream()
+        channel = _Channel(stream)
+        results = []
+
+        channel.send(1, "query", results.append, exhaust=True)
+        # Each batch answers the one before it, until the cursor is done.
+        stream.reply(1, struct.pack("<iq", 0, 7) + "a", request_id=10)
+        stream.reply(10, struct.pack("<iq", 0, 7) + "b", request_id=11)
+        self.assertEqual(["query"], stream.written)
+        self.assertEqual([11], channel.pending.keys())
+        stream.reply(11, struct.pack("<iq", 0, 0) + "c", request_id=12)
+        self.assertEqual(["a", "b", "c"], [r[12:] for r in results])
+        self.assertFalse(channel.pending)
+        self.assertFalse(stream.reads)
+
+    def test_write_later(self):
+        stream = _FakeStream()
+        channel = _Channel(stream)
+
+        channel.write_later("a", 10)
+        channel.write_later("b", 10)
+        self.assertEqual([], stream.written)
+        self.assertEqual(1, len(stream.io_loop.callbacks))
+        stream.io_loop.callbacks.pop()()
+        self.assertEqual(["ab"], stream.written)
+
+        channel.write_later("c" * 6, 10)
+        channel.write_later("d" * 6, 10)
+        self.assertEqual(["ab", "c" * 6 + "d" * 6], stream.written)
+
+        # Anything queued goes out ahead of a message sent directly.
+        channel.write_later("e", 10)
+        channel.send(1, "query", lambda r: None)
+        self.assertEqual("equery", stream.written[-1])
+        for callback in stream.io_loop.callbacks:
+            callback()
+        self.assertEqual(3, len(stream.written))
+
+    def test_write_later_before_other_streams(self):
+        connection = Connection("localhost", 27017, io_loop=_FakeIOLoop(),
+                                coalesce_writes=True, _connect=False)
+        address = ("localhost", 27017)
+        written = []
+
+        class Stream(_FakeStream):
+            def write(self, data, callback=None):
+                written.append((self, data))
+
+        def factory(callback):
+            channel = _Channel(Stream())
+            channel.address = address
+            callback(channel)
+
+        pool = connection._Connection__pools[address] = _Pool(factory)
+        connection._Connection__set_primary(address)
+        connection.db.coll.insert({"_id": 1})
+        self.assertEqual([], written)
+
+        # Someone else has the stream the insert is queued on...
+        held = []
+        pool.checkout(held.append)
+        connection.db.coll.insert({"_id": 2}, safe=True)
+        # ...but it is written out before the next write, on another.
+        self.assertEqual(2, len(written))
+        self.assert_(written[0][0] is held[0].stream)
+        self.assert_(written[1][0] is not held[0].stream)
+
+
+class _FakeChannel(object):
+
+    def __init__(self):
+        self.pending = {}
+        self.is_closed = False
+        self.dedicated = False
+        self.created = self.last_used = time.time()
+
+    def closed(self):
+        return self.is_closed
+
+    def close(self):
+        self.is_closed = True
+
+
+class TestPool(unittest.TestCase):
+
+    def setUp(self):
+        self.opened = []
+
+        def factory(callback):
+            channel = _FakeChannel()
+            self.opened.append(channel)
+            callback(channel)
+
+        self.factory = factory
+
+    def test_bounded_with_fifo_waiters(self):
+        pool = _Pool(self.factory, max_size=2)
+        got = []
+        for _ in range(4):
+            pool.checkout(got.append)
+        self.assertEqual(2, len(self.opened))
+        self.assertEqual(self.opened, got)
+        self.assertEqual(2, len(pool.waiters))
+
+        pool.checkin(got[1])
+        pool.checkin(got[0])
+        self.assertEqual([self.opened[1], self.opened[0]], got[2:])
+        self.assertEqual(2, len(self.opened))
+
+        pool.checkin(got[2])
+        pool.checkout(got.append)
+        self.assertEqual(got[2], got[4])
+
+    def test_closed_channel_frees_slot_for_waiter(self):
+        pool = _Pool(self.factory, max_size=1)
+        got = []
+        pool.checkout(got.append)
+        pool.checkout(got.append)
+        self.assertEqual(1, len(got))
+
+        got[0].close()
+        pool.checkin(got[0])
+        self.assertEqual(2, len(got))
+        self.assertEqual(2, len(self.opened))
+        self.assertEqual(1, pool.size)
+
+    def test_check(self):
+        pool = _Pool(self.factory, max_size=5, min_size=1, max_idle_time=60)
+        got = []
+        for _ in range(3):
+            pool.checkout(got.append)
+        for channel in got:
+            pool.checkin(channel)
+        (stale, quiet, busy) = got
+        stale.last_used -= 120
+        quiet.last_used -= 30
+        pinged = []
+
+        def ping(channel, done):
+            pinged.append(channel)
+            done(channel is quiet and AutoReconnect("dead") or None)
+
+        pool.check(ping, time.time() - 10)
+        self.assertEqual([quiet], pinged)
+        self.assert_(stale.closed())
+        self.assert_(quiet.closed())
+        self.assertEqual([busy], list(pool.idle))
+
+        # Never drop below min_size.
+        busy.last_used -= 120
+        pool.check(ping, time.time() - 10)
+        self.assertEqual([busy], list(pool.idle))
+
+    def test_fill(self):
+        pool = _Pool(self.factory, max_size=5)
+        prepared = []
+        results = []
+
+        def prepare(channel, done):
+            prepared.append(channel)
+            if len(prepared) == 2:
+                done(AutoReconnect("bad channel"))
+            else:
+                done()
+
+        pool.fill(3, prepare, results.append)
+        self.assertEqual(3, len(prepared))
+        self.assertEqual(1, len(results))
+        self.assert_(isinstance(results[0], AutoReconnect))
+        self.assertEqual(2, len(pool.idle))
+        self.assert_(prepared[1].closed())
+
+        pool.fill(2, prepare, results.append)
+        self.assertEqual([None], results[1:])
+        self.assertEqual(3, len(prepared))
+
+
+class _FakeNode(object):
+
+    def __init__(self, ismaster, rtt, up=True):
+        self.up = up
+        self.ismaster = ismaster
+        self.secondary = not ismaster
+        self.rtt = rtt
+
+
+class TestReadPreference(unittest.TestCase):
+
+    def test_select_node(self):
+        primary = _FakeNode(True, 0.001)
+        near = _FakeNode(False, 0.002)
+        far = _FakeNode(False, 0.100)
+        down = _FakeNode(False, 0.0, up=False)
+        nodes = [primary, near, far, down]
+
+        self.assertEqual(primary,
+                         select_node(ReadPreference.PRIMARY, nodes, 0.015))
+        for i in range(20):
+            self.assertEqual(near, select_node(ReadPreference.SECONDARY,
+                                               nodes, 0.015))
+            self.assert_(select_node(ReadPreference.NEAREST, nodes, 0.015)
+                         in (primary, near))
+
+        self.assertEqual(None, select_node(ReadPreference.SECONDARY,
+                                           [primary], 0.015))
+        self.assertEqual(primary,
+                         select_node(ReadPreference.SECONDARY_PREFERRED,
+                                     [primary, down], 0.015))
+        self.assertEqual(None, select_node(ReadPreference.PRIMARY,
+                                           [near], 0.015))
+        self.assertEqual(near, select_node(ReadPreference.PRIMARY_PREFERRED,
+                                           [near], 0.015))
+
+
+def _connection_to_fake_nodes(seeds, **kwargs):
+    """A Connection to `seeds` whose channels are _FakeStreams, one per
+    node, kept in the dict returned along with it (which holds the last
+    stream opened to each node).
+    """
+    connection = Connection(seeds, io_loop=_FakeIOLoop(), _connect=False,
+                            **kwargs)
+    streams = {}
+
+    def connect_to(address, callback):
+        stream = streams[address] = _FakeStream()
+        channel = _Channel(stream)
+        channel.address = address
+        callback(channel)
+
+    connection._Connection__connect_to = connect_to
+    return (connection, streams)
+
+
+def _answer(stream, document):
+    """Reply to the last message written to `stream` with `document`
+    (ok unless it says otherwise).
+    """
+    request_id = struct.unpack_from("<i", stream.written[-1], 4)[0]
+    document.setdefault("ok", 1)
+    stream.reply(request_id, _reply_body(document))
+
+
+def _add_node(connection, address, **attributes):
+    """Register a known node at `address` with `connection`, setting
+    `attributes` on it.
+    """
+    node = _Node(address)
+    for (name, value) in attributes.items():
+        setattr(node, name, value)
+    connection._Connection__node_states[address] = node
+    return node
+
+
+class TestTopology(unittest.TestCase):
+
+    def test_secondary_reports_primary(self):
+        (connection, streams) = _connection_to_fake_nodes(
+            ["localhost:27018", "localhost:27019"])
+        connection._Connection__find_master()
+        self.assertEqual(set([("localhost", 27018), ("localhost", 27019)]),
+                         set(streams))
+        self.assertEqual(None, connection.host)
+
+        _answer(streams[("localhost", 27018)], {
+                "ismaster": False, "secondary": True,
+                "hosts": ["localhost:27017", "localhost:27018",
+                          "localhost:27019"]})
+        self.assertEqual(None, connection.host)
+        _answer(streams[("localhost", 27017)], {"ismaster": True})
+        self.assertEqual(("localhost", 27017),
+                         (connection.host, connection.port))
+        self.assert_(connection.topology[("localhost", 27017)]["ismaster"])
+        self.assert_(connection.topology[("localhost", 27018)]["secondary"])
+
+    def test_discovered_host_probed(self):
+        (connection, streams) = _connection_to_fake_nodes(
+            ["localhost:27017", "localhost:27018"])
+        connection._Connection__find_master()
+        _answer(streams[("localhost", 27017)], {
+                "ismaster": True, "passives": ["localhost:27020"]})
+
+        passive = streams[("localhost", 27020)]
+        self.assertEqual(1, len(passive.written))
+        self.assert_("ismaster" in passive.written[0])
+        _answer(passive, {"ismaster": False, "secondary": True})
+        self.assert_(connection.topology[("localhost", 27020)]["up"])
+        self.assertEqual(("localhost", 27017),
+                         (connection.host, connection.port))
+
+    def test_failover(self):
+        (connection, streams) = _connection_to_fake_nodes(
+            ["localhost:27017", "localhost:27018"])
+        old = ("localhost", 27017)
+        new = ("localhost", 27018)
+        connection._Connection__find_master()
+        _answer(streams[old], {"ismaster": True})
+        _answer(streams[new], {"ismaster": False,
+                                        "secondary": True})
+        self.assertEqual(old, (connection.host, connection.port))
+
+        connection._Connection__check_topology()
+        _answer(streams[old], {"ismaster": False,
+                                        "secondary": True})
+        self.assertEqual(None, connection.host)
+        _answer(streams[new], {"ismaster": True})
+        self.assertEqual(new, (connection.host, connection.port))
+
+    def test_ready_once_primary_found_late(self):
+        (connection, streams) = _connection_to_fake_nodes(
+            ["localhost:27017", "localhost:27018"], warm_up=True)
+        primary = ("localhost", 27017)
+        results = []
+        connection._Connection__find_master()
+        for stream in streams.values():
+            _answer(stream, {"ismaster": False, "secondary": True})
+        connection.when_ready(results.append)
+        self.assertEqual(1, len(results))
+        self.assert_(isinstance(results[0], AutoReconnect))
+
+        # A later heartbeat finds the primary, and the pool is warmed up.
+        connection._Connection__check_topology()
+        monitor = streams[primary]
+        _answer(monitor, {"ismaster": True})
+        self.assert_(streams[primary] is not monitor)
+        connection.when_ready(results.append)
+        self.assertEqual(1, len(results))
+        _answer(streams[primary], {"ismaster": True})
+        self.assertEqual([connection], results[1:])
+
+        connection.when_ready(results.append)
+        self.assertEqual([connection, connection], results[1:])
+
+    def test_rtt_smoothing(self):
+        node = _Node(("localhost", 27017))
+        node.record({"ismaster": True}, 0.010)
+        self.assertEqual(0.010, node.rtt)
+        node.record({"ismaster": True}, 0.020)
+        self.assertAlmostEqual(0.012, node.rtt)
+
+
+class TestBuffering(unittest.TestCase):
+
+    def test_buffer_without_primary(self):
+        loop = _FakeIOLoop()
+        connection = Connection("localhost", 27017, io_loop=loop,
+                                max_buffered_ops=1, buffer_timeout=5,
+                                _connect=False)
+        results = []
+        query = message.query(0, "test.test", 0, 0, {})
+        connection._send_message_with_response(query, results.append)
+        self.assertEqual([], results)
+
+        connection._send_message_with_response(query, results.append)
+        self.assertEqual(1, len(results))
+        self.assert_(isinstance(results[0], AutoReconnect))
+
+        # One timeout for the buffered operation and one, much sooner,
+        # to look for a primary again.
+        self.assertEqual(2, len(loop.timeouts))
+        (deadline, on_timeout) = max(loop.timeouts)
+        self.assert_(deadline - time.time() > 4)
+        on_timeout()
+        self.assertEqual(2, len(results))
+        self.assert_(isinstance(results[1], AutoReconnect))
+
+    def test_buffered_exhaust_query_keeps_dedicated_stream(self):
+        (connection, stream) = _connection_to_fake_stream(
+            io_loop=_FakeIOLoop(), multiplex=True)
+        address = ("localhost", 27017)
+        pool = connection._Connection__pools[address]
+        opened = []
+
+        def factory(callback, open=pool.stream_factory):
+            def on_open(channel):
+                opened.append(channel)
+                callback(channel)
+            open(on_open)
+
+        pool.stream_factory = factory
+        connection._Connection__set_primary(None)
+        query = message.query(64, "db.coll", 0, 0, {})
+        connection._send_message_with_response(query, lambda r: None,
+                                               _exhaust=True)
+        self.assertEqual([], stream.written)
+
+        connection._Connection__set_primary(address)
+        connection._Connection__flush_buffered()
+        self.assertEqual([query[1]], stream.written)
+        self.assertEqual([True], [channel.dedicated for channel in opened])
+        self.assertEqual([], pool.channels)
+
+
+class TestWriteTimeout(unittest.TestCase):
+
+    def test_network_timeout_on_safe_write(self):
+        (connection, stream) = _connection_to_fake_stream()
+        results = []
+        connection.db.coll.insert({"_id": 1}, safe=True, network_timeout=5,
+                                  callback=results.append)
+
+        self.assertEqual(1, len(stream.io_loop.timeouts))
+        (deadline, _) = stream.io_loop.timeouts[0]
+        self.assert_(4 < deadline - time.time() <= 5)
+        stream.io_loop.fire_timeouts()
+        self.assertEqual(1, len(results))
+        self.assert_(isinstance(results[0], NetworkTimeout))
+
+    def __assert_times_out_waiting(self, connection, loop):
+        results = []
+        query = message.query(0, "db.coll", 0, 0, {})
+        before = list(loop.timeouts)
+        connection._send_message_with_response(query, results.append,
+                                               network_timeout=1)
+        self.assertEqual([], results)
+        # (Looking for a primary again is scheduled much sooner.)
+        (deadline, on_timeout) = max(timeout for timeout in loop.timeouts
+                                     if timeout not in before)
+        self.assert_(0 < deadline - time.time() <= 1)
+        on_timeout()
+        self.assertEqual(1, len(results))
+        self.assert_(isinstance(results[0], NetworkTimeout))
+
+    def test_network_timeout_while_buffered(self):
+        loop = _FakeIOLoop()
+        connection = Connection("localhost", 27017, io_loop=loop,
+                                _connect=False)
+        self.__assert_times_out_waiting(connection, loop)
+        self.assertEqual(0, len(connection._Connection__buffered))
+
+    def test_network_timeout_waiting_to_be_admitted(self):
+        loop = _FakeIOLoop()
+        (connection, stream) = _connection_to_fake_stream(io_loop=loop,
+                                                          max_in_flight=1)
+        first = message.query(0, "db.coll", 0, 0, {})
+        connection._send_message_with_response(first, lambda r: None)
+        self.__assert_times_out_waiting(connection, loop)
+
+        # The next operation goes ahead in the first one's place.
+        stream.reply(first[0], _reply_body({}))
+        connection._send_message_with_response(first, lambda r: None)
+        self.assertEqual(2, len(stream.written))
+
+    def test_network_timeout_waiting_for_channel(self):
+        loop = _FakeIOLoop()
+        (connection, stream) = _connection_to_fake_stream(io_loop=loop)
+        pool = connection._Connection__pools[("localhost", 27017)]
+        pool.io_loop = loop
+        pool.shared = False
+        pool.max_size = 1
+        held = []
+        pool.checkout(held.append)
+        self.__assert_times_out_waiting(connection, loop)
+        self.assertEqual(0, len(pool.waiters))
+
+
+def _reply_body(document):
+    return struct.pack("<iqii", 0, 0, 0, 1) + BSON.encode(document)
+
+
+class TestDecoding(unittest.TestCase):
+
+    def setUp(self):
+        self.docs = [{"a": 1}, {"b": u"two"}, {"c": [3]}]
+        self.data = "".join(BSON.encode(doc) for doc in self.docs)
+
+    def test_decode_all_from_buffer(self):
+        self.assertEqual(self.docs, bson.decode_all(self.data))
+        self.assertEqual(self.docs, bson.decode_all(buffer(self.data)))
+        self.assertEqual(self.docs[1:], bson.decode_all(
+                buffer(self.data, len(BSON.encode(self.docs[0])))))
+
+    def test_decode_all_invalid(self):
+        try:
+            bson.decode_all(self.data[:-1])
+        except InvalidBSON, e:
+            self.assertEqual("objsize too large", str(e))
+        else:
+            self.fail("InvalidBSON not raised")
+        try:
+            bson.decode_all(self.data[:-1] + "\x01")
+        except InvalidBSON, e:
+            self.assertEqual("bad eoo", str(e))
+        else:
+            self.fail("InvalidBSON not raised")
+        try:
+            bson.decode_all("\x00" * 5)
+        except InvalidBSON, e:
+            self.assertEqual("objsize too small", str(e))
+        else:
+            self.fail("InvalidBSON not raised")
+
+    def test_unpack_response_size(self):
+        response = _reply_body({"a": 1})
+        result = helpers._unpack_response(response)
+        self.assertEqual(len(BSON.encode({"a": 1})), result["size"])
+        self.assertEqual([{"a": 1}], result["data"])
+
+
+class TestAuth(unittest.TestCase):
+
+    def test_streams_log_out_lazily(self):
+        connection = Connection("localhost", 27017, _connect=False)
+        stream = _FakeStream()
+        channel = _Channel(stream)
+        channel.authset.add((u"test", u"user", "password"))
+        results = []
+
+        connection._Connection__prepare(results.append, time.time(),
+                                        None, channel)
+        self.assertEqual([], results)
+        self.assertEqual(1, len(stream.written))
+
+        stream.reply(struct.unpack("<i", stream.written[0][4:8])[0],
+                     _reply_body({"ok": 1}))
+        self.assertEqual([channel], results)
+        self.assertEqual(set(), channel.authset)
+
+        connection._Connection__prepare(results.append, time.time(),
+                                        None, channel)
+        self.assertEqual([channel, channel], results)
+        self.assertEqual(1, len(stream.written))
+
+
+    def test_shared_stream_authenticates_once(self):
+        (connection, stream) = _connection_to_fake_stream()
+        connection._Connection__pools[("localhost", 27017)].max_size = 1
+        connection._Connection__credentials["test"] = (u"test", u"user",
+                                                       "password")
+        results = []
+        connection._Connection__stream(results.append)
+        connection._Connection__stream(results.append)
+        self.assertEqual(1, len(stream.written))
+        self.assert_("getnonce" in stream.written[0])
+
+        _answer(stream, {"ok": 1, "nonce": "abc"})
+        self.assert_("authenticate" in stream.written[1])
+        _answer(stream, {"ok": 1})
+        self.assertEqual(2, len(stream.written))
+        self.assertEqual(2, len(results))
+        self.assert_(results[0] is results[1])
+
+    def test_reauthenticate_replaces_user(self):
+        (connection, stream) = _connection_to_fake_stream()
+        connection._Connection__credentials["test"] = (u"test", u"old",
+                                                       "password")
+        results = []
+        connection._Connection__stream(results.append)
+        _answer(stream, {"ok": 1, "nonce": "abc"})
+        _answer(stream, {"ok": 1})
+        channel = results[0]
+        connection._Connection__checkin(channel)
+
+        connection._authenticate("test", "new", "secret", results.append)
+        _answer(stream, {"ok": 1, "nonce": "def"})
+        _answer(stream, {"ok": 1})
+        self.assertEqual(True, results[1])
+        self.assertEqual(set([(u"test", u"new", "secret")]), channel.authset)
+
+        # Nothing is logged out (or in) the next time the stream is used.
+        connection._Connection__stream(results.append)
+        self.assertEqual(4, len(stream.written))
+        self.assert_(results[2] is channel)
+
+
+class TestMetrics(unittest.TestCase):
+
+    def test_record_and_render(self):
+        metrics = Metrics(lambda: [(("a", 1), 3, 1)])
+        address = ("a", 1)
+
+        metrics.started(address, "command")
+        self.assertEqual(1, metrics.snapshot()["nodes"]["a:1"]["in_flight"])
+        metrics.finished(address, "command", 0.003)
+        metrics.started(address, "query")
+        metrics.finished(address, "query", 0.5)
+        metrics.started(address, "insert", False)
+
+        snapshot = metrics.snapshot()
+        self.assertEqual({"open": 3, "idle": 1, "in_flight": 0},
+                         snapshot["nodes"]["a:1"])
+        self.assertEqual({"command": {"count": 1}, "query": {"count": 1},
+                          "insert": {"count": 1}}, snapshot["ops"])
+        self.assertEqual(1, snapshot["latency"]["query"]["count"])
+        self.assert_(0.5 <= snapshot["latency"]["query"]["p99"] < 1)
+
+        text = metrics.prometheus()
+        self.assert_('apymongo_streams_open{node="a:1"} 3' in text)
+        self.assert_('apymongo_op_duration_seconds_bucket'
+                     '{op="query",le="+Inf"} 1' in text)
+        self.assert_('apymongo_op_duration_seconds_count{op="query"} 1'
+                     in text)
+
+
+    def test_op_type(self):
+        self.assertEqual("command", _op_type(
+            message.query(0, "db.$cmd", 0, -1, {"ping": 1})[1]))
+        self.assertEqual("query", _op_type(
+            message.query(0, "db.coll", 0, 0, {})[1]))
+        self.assertEqual("delete", _op_type(
+            message.delete_op_msg("db.coll", {}, False, {})[1]))
+
+    def test_op_type_from_caller(self):
+        (connection, stream) = _connection_to_fake_stream()
+        connection.db.coll.remove({})
+        connection._send_message(message.query(0, "db.coll", 0, 0, {}),
+                                 _op_type="getmore")
+        self.assertEqual({"delete": {"count": 1}, "getmore": {"count": 1}},
+                         connection.metrics.snapshot()["ops"])
+
+    def test_disabled(self):
+        (connection, stream) = _connection_to_fake_stream(metrics=False)
+        self.assertEqual(None, connection.metrics)
+        results = []
+        connection.db.coll.insert({"_id": 1}, callback=results.append)
+        self.assertEqual([1], results)
+        self.assertEqual(1, len(stream.written))
+
+
+class TestOpMsg(unittest.TestCase):
+
+    def test_insert_document_sequence(self):
+        (request_id, data) = message.insert_op_msg("db.coll", [{"a": 1},
+                                                               {"a": 2}],
+                                                   False, True, {})
+        (length, _, _, operation, flags) = struct.unpack_from("<iiiiI", data)
+        self.assertEqual((len(data), message.OP_MSG, 0),
+                         (length, operation, flags))
+        size = struct.unpack_from("<i", data, 21)[0]
+        self.assertEqual({"insert": "coll", "ordered": True, "$db": "db"},
+                         BSON(data[21:21 + size]).decode())
+        self.assertEqual("\x01", data[21 + size])
+        self.assertEqual("documents\x00", data[26 + size:36 + size])
+        self.assertEqual(BSON.encode({"a": 1}) + BSON.encode({"a": 2}),
+                         data[36 + size:])
+
+    def test_write_errors(self):
+        connection = Connection("localhost", 27017, _connect=False)
+        check = connection._Connection__check_write_reply
+
+        def reply(document):
+            return struct.pack("<I", 0) + "\x00" + BSON.encode(document)
+
+        self.assertEqual({"ok": 1, "n": 2, "err": None},
+                         check(reply({"ok": 1, "n": 2})))
+        error = check(reply({"ok": 1, "n": 1, "writeErrors": [
+                    {"index": 1, "code": 11000, "errmsg": "dup"}]}))
+        self.assert_(isinstance(error, DuplicateKeyError))
+        self.assertEqual(1, error.details["writeErrors"][0]["index"])
+
+    def test_insert_reports_write_errors(self):
+        (connection, stream) = _connection_to_fake_stream()
+        _add_node(connection, ("localhost", 27017), max_wire_version=6)
+        results = []
+        connection.db.coll.insert([{"_id": 1}, {"_id": 2}], safe=True,
+                                  callback=results.append)
+
+        request_id = struct.unpack_from("<i", stream.written[0], 4)[0]
+        stream.reply(request_id, struct.pack("<I", 0) + "\x00" +
+                     BSON.encode({"ok": 1, "n": 1, "writeErrors": [
+                         {"index": 1, "code": 11000, "errmsg": "dup"}]}),
+                     message.OP_MSG)
+        self.assertEqual(1, len(results))
+        self.assert_(isinstance(results[0], DuplicateKeyError))
+        self.assertEqual(1, results[0].details["writeErrors"][0]["index"])
+
+    def test_update_result_like_get_last_error(self):
+
+        def update(max_wire_version, body, operation, upsert):
+            (connection, stream) = _connection_to_fake_stream()
+            _add_node(connection, ("localhost", 27017),
+                      max_wire_version=max_wire_version)
+            results = []
+            connection.db.coll.update({"_id": 5}, {"$set": {"a": 1}},
+                                      upsert=upsert, safe=True,
+                                      callback=results.append)
+            # The reply is to the last message written: the getLastError
+            # that follows a legacy update, or the update command.
+            data = stream.written[0]
+            offset = 0
+            while True:
+                length = struct.unpack_from("<i", data, offset)[0]
+                if offset + length == len(data):
+                    break
+                offset += length
+            stream.reply(struct.unpack_from("<i", data, offset + 4)[0], body,
+                         operation)
+            return results[0]
+
+        def op_msg(document):
+            return (struct.pack("<I", 0) + "\x00" + BSON.encode(document),
+                    message.OP_MSG)
+
+        cases = [
+            ({"ok": 1, "n": 1, "err": None, "updatedExisting": True},
+             {"ok": 1, "n": 1, "nModified": 1}, False),
+            ({"ok": 1, "n": 1, "err": None, "updatedExisting": False,
+              "upserted": 5},
+             {"ok": 1, "n": 1, "nModified": 0,
+              "upserted": [{"index": 0, "_id": 5}]}, True),
+            ({"ok": 1, "n": 0, "err": None, "updatedExisting": False},
+             {"ok": 1, "n": 0, "nModified": 0}, False)]
+        for (legacy, command, upsert) in cases:
+            expected = update(0, _reply_body(legacy), 1, upsert)
+            (body, operation) = op_msg(command)
+            result = update(6, body, operation, upsert)
+            self.assertEqual(expected,
+                             dict((key, result[key]) for key in expected))
+
+
+class TestCompression(unittest.TestCase):
+
+    def test_handshake_and_auth_not_compressed(self):
+        for command in [SON([("ismaster", 1)]),
+                        SON([("authenticate", 1), ("nonce", "n"),
+                             ("user", "u"), ("key", "k")])]:
+            command["pad"] = "p" * 100
+            data = message.query(0, "admin.$cmd", 0, -1, command)[1]
+            self.assertEqual(data, message.compress(data))
+        data = message.query(0, "admin.$cmd", 0, -1,
+                             {"count": "coll", "pad": "p" * 100})[1]
+        self.assertNotEqual(data, message.compress(data))
+
+    def test_negotiated_per_stream(self):
+        (connection, streams) = _connection_to_fake_nodes(
+            ["localhost:27017"], compressors=["zlib"],
+            compression_threshold=0)
+        address = ("localhost", 27017)
+        connection._Connection__set_primary(address)
+        query = message.query(0, "db.coll", 0, 0, {"x": "x" * 100})
+        connection._send_message_with_response(query, lambda r: None)
+
+        # A new pooled stream agrees on compression before it is used.
+        stream = streams[address]
+        self.assertEqual(1, len(stream.written))
+        self.assert_("ismaster" in stream.written[0])
+        _answer(stream, {"ismaster": True,
+                                  "compression": ["zlib"]})
+        self.assertEqual(message.OP_COMPRESSED,
+                         struct.unpack_from("<i", stream.written[1], 12)[0])
+
+        # A stream the server didn't agree on isn't compressed.
+        pool = connection._Connection__pools[address]
+        pool.fill(2, lambda channel, done: done(), lambda error: None)
+        _answer(streams[address], {"ismaster": True})
+        channel = [channel for channel in pool.channels
+                   if channel.stream is streams[address]][0]
+        self.assertEqual(None, channel.compression)
+
+
+class TestFork(unittest.TestCase):
+
+    def test_lazy_connect(self):
+        loop = _FakeIOLoop()
+        connection = Connection("localhost", 27017, io_loop=loop,
+                                connect=False)
+        self.assertEqual([], loop.timeouts)
+        self.assertEqual(None, connection.host)
+
+    def test_after_fork_forgets_without_closing(self):
+        connection = Connection("localhost", 27017, _connect=False)
+        address = ("localhost", 27017)
+        channel = _FakeChannel()
+        pool = _Pool(lambda callback: callback(channel))
+        pool.checkout(lambda ch: pool.checkin(ch))
+        connection._Connection__pools[address] = pool
+        connection._Connection__set_primary(address)
+        connection.metrics.started(address, "query")
+        connection.set_cursor_manager(BatchCursorManager)
+        connection.close_cursor(42)
+        killed = []
+        connection.kill_cursors = lambda ids, address=None: killed.append(ids)
+
+        connection.after_fork()
+        self.assertEqual({}, connection._Connection__pools)
+        self.assertEqual(None, connection.host)
+        self.assertFalse(channel.closed())
+        # The parent's query will never finish here...
+        self.assertEqual({}, connection.metrics.snapshot()["nodes"])
+        # ...and its cursor isn't ours to kill.
+        connection.set_cursor_manager(CursorManager)
+        self.assertEqual([], killed)
+
+
+def _connection_to_fake_stream(**kwargs):
+    """A Connection whose primary, localhost:27017, has a pool that opens
+    channels on a single _FakeStream.
+    """
+    connection = Connection("localhost", 27017, _connect=False, **kwargs)
+    address = ("localhost", 27017)
+    stream = _FakeStream()
+
+    def factory(callback):
+        channel = _Channel(stream)
+        channel.address = address
+        callback(channel)
+
+    connection._Connection__pools[address] = _Pool(factory, shared=True)
+    connection._Connection__set_primary(address)
+    return (connection, stream)
+
+
+class _RecordingListener(OperationListener):
+
+    def __init__(self):
+        self.events = []
+
+    def started(self, event):
+        self.events.append(("started", event))
+
+    def succeeded(self, event):
+        self.events.append(("succeeded", event))
+
+    def failed(self, event):
+        self.events.append(("failed", event))
+
+
+class TestEvents(unittest.TestCase):
+
+    def test_started_and_succeeded(self):
+        listener = _RecordingListener()
+        (connection, stream) = _connection_to_fake_stream(
+            event_listeners=[listener])
+        address = ("localhost", 27017)
+
+        results = []
+        query = connection._encode(message.query, 0, "db.coll", 0, 0, {})
+        connection._send_message_with_response(
+            query, results.append, _decode=helpers._unpack_response)
+        self.assertEqual(["started"], [kind for (kind, _) in listener.events])
+        started = listener.events[0][1]
+        self.assertEqual("query", started.op_type)
+        self.assertEqual(u"db.coll", started.namespace)
+        self.assertEqual(query[0], started.request_id)
+        self.assertEqual(len(query[1]), started.size)
+        self.assert_(started.durations["encode"] is not None)
+
+        stream.reply(query[0], _reply_body({"x": 1}))
+        self.assertEqual([(address, {"x": 1})],
+                         [(a, r["data"][0]) for (a, r) in results])
+        (kind, event) = listener.events[1]
+        self.assertEqual("succeeded", kind)
+        self.assertEqual(["decode", "encode", "pool_wait", "server_wait",
+                          "write"], sorted(event.durations))
+
+
+    def test_failed_without_stream(self):
+        listener = _RecordingListener()
+        (connection, stream) = _connection_to_fake_stream(
+            event_listeners=[listener], max_in_flight=1,
+            max_in_flight_queue=0)
+        connection._send_message_with_response(
+            message.query(0, "db.coll", 0, 0, {}), lambda r: None)
+        results = []
+        query = connection._encode(message.query, 0, "db.coll", 0, 0, {})
+        connection._send_message_with_response(query, results.append)
+
+        self.assert_(isinstance(results[0], OverloadedError))
+        (kind, event) = listener.events[-1]
+        self.assertEqual("failed", kind)
+        self.assertEqual(query[0], event.request_id)
+        self.assertEqual(("localhost", 27017), event.address)
+        self.assert_(event.failure is results[0])
+        self.assert_(event.durations["pool_wait"] is not None)
+        self.assert_(event.durations["encode"] is not None)
+
+
+class TestInFlight(unittest.TestCase):
+
+    def test_limit_and_queue(self):
+        (connection, stream) = _connection_to_fake_stream(
+            max_in_flight=1, max_in_flight_queue=1)
+        results = []
+        queries = [message.query(0, "db.coll", 0, 0, {}) for i in range(3)]
+        for query in queries:
+            connection._send_message_with_response(query, results.append)
+
+        self.assertEqual(1, len(stream.written))
+        self.assertEqual(1, len(results))
+        self.assert_(isinstance(results[0], OverloadedError))
+
+        stream.reply(queries[0][0], "first")
+        self.assertEqual("first", results[1][1])
+        self.assertEqual(2, len(stream.written))
+        stream.reply(queries[1][0], "second")
+        self.assertEqual("second", results[2][1])
+
+
+class TestCircuitBreaker(unittest.TestCase):
+
+    def test_open_half_open_close(self):
+        breaker = _CircuitBreaker(2, 60)
+        breaker.failed()
+        self.assert_(breaker.allow())
+        breaker.failed()
+        self.assertFalse(breaker.available())
+        self.assertFalse(breaker.allow())
+
+        # Once the reset timeout has passed a single probe goes through.
+        breaker.changed -= 60
+        self.assert_(breaker.allow())
+        self.assertFalse(breaker.allow())
+        breaker.failed()
+        self.assertFalse(breaker.allow())
+
+        breaker.changed -= 60
+        self.assert_(breaker.allow())
+        breaker.succeeded()
+        self.assert_(breaker.allow())
+        breaker.failed()
+        self.assert_(breaker.allow())
+
+
+class TestHedgedReads(unittest.TestCase):
+
+    def test_second_node_wins(self):
+        (connection, streams) = _connection_to_fake_nodes(
+            ["localhost:27017", "localhost:27018"], multiplex=True,
+            hedge_percentile=95)
+        for (port, ismaster) in ((27017, True), (27018, False)):
+            _add_node(connection, ("localhost", port), up=True,
+                      ismaster=ismaster, secondary=not ismaster, rtt=0.001)
+        connection._Connection__set_primary(("localhost", 27017))
+
+        histogram = _Histogram()
+        for i in range(20):
+            histogram.record(0.001)
+        connection._Connection__hedge_latency[u"db.coll"] = histogram
+
+        results = []
+        query = message.query(4, "db.coll", 0, 0, {})
+        connection._send_message_with_response(
+            query, results.append, _decode=helpers._unpack_response,
+            read_preference=ReadPreference.NEAREST, _hedge=True)
+        (first,) = streams
+        self.assertEqual(1, len(streams[first].written))
+
+        connection._Connection__io_loop.fire_timeouts()
+        (second,) = set(streams) - set([first])
+        self.assertEqual(1, len(streams[second].written))
+        self.assertEqual(1, connection.metrics.hedged)
+
+        streams[second].reply(query[0], struct.pack("<iqii", 0, 0, 0, 1) +
+                              BSON.encode({"x": 2}))
+        self.assertEqual([(second, {"x": 2})],
+                         [(a, r["data"][0]) for (a, r) in results])
+
+        # The slow node's reply is dropped and its cursor killed.
+        streams[first].reply(query[0], struct.pack("<iqii", 0, 42, 0, 1) +
+                             BSON.encode({"x": 1}))
+        self.assertEqual(1, len(results))
+        self.assertEqual(message.kill_cursors([42])[1][8:],
+                         streams[first].written[-1][8:])
+
+
+class TestCursorPrefetch(unittest.TestCase):
+
+    def test_clone_keeps_options(self):
+        (connection, stream) = _connection_to_fake_stream()
+        cursor = connection.db.coll.find(
+            spec={"a": 1}, callback=lambda result: None, prefetch=True,
+            read_preference=ReadPreference.SECONDARY, network_timeout=5)
+        clone = cursor.clone()
+        self.assertEqual({"a": 1}, clone._Cursor__spec)
+        self.assert_(clone._Cursor__prefetch)
+        self.assertEqual(ReadPreference.SECONDARY,
+                         clone._Cursor__read_preference)
+        self.assertEqual({"network_timeout": 5}, clone._Cursor__kwargs)
+
+    def test_get_more_sent_before_processing(self):
+        (connection, stream) = _connection_to_fake_stream()
+        results = []
+        written = []
+
+        def processor(doc, collection):
+            written.append(len(stream.written))
+            return doc
+
+        connection.db.coll.find(callback=results.append,
+                                processor=processor, prefetch=True).loop()
+        self.assertEqual(1, len(stream.written))
+        stream.reply(struct.unpack_from("<i", stream.written[0], 4)[0],
+                     struct.pack("<iqii", 0, 7, 0, 1) +
+                     BSON.encode({"x": 1}))
+        # The getMore went out before the first batch was processed.
+        self.assertEqual([2], written)
+        self.assertEqual([], results)
+
+        stream.reply(struct.unpack_from("<i", stream.written[1], 4)[0],
+                     struct.pack("<iqii", 0, 0, 1, 1) +
+                     BSON.encode({"x": 2}))
+        self.assertEqual([2, 2], written)
+        self.assertEqual([[{"x": 1}, {"x": 2}]], results)
+
+
+class TestCursorBatches(unittest.TestCase):
+
+    def test_waits_for_consumer(self):
+        (connection, stream) = _connection_to_fake_stream()
+        batches = []
+        connection.db.coll.find().batches(
+            lambda batch, more: batches.append((batch, more)))
+
+        stream.reply(struct.unpack_from("<i", stream.written[0], 4)[0],
+                     struct.pack("<iqii", 0, 7, 0, 1) +
+                     BSON.encode({"x": 1}))
+        self.assertEqual([[{"x": 1}]], [batch for (batch, _) in batches])
+        # Nothing more is fetched until the consumer asks for it.
+        self.assertEqual(1, len(stream.written))
+
+        batches[0][1]()
+        self.assertEqual(2, len(stream.written))
+        stream.reply(struct.unpack_from("<i", stream.written[1], 4)[0],
+                     struct.pack("<iqii", 0, 0, 1, 1) +
+                     BSON.encode({"x": 2}))
+        self.assertEqual([{"x": 2}], batches[1][0])
+
+        batches[1][1]()
+        self.assertEqual((None, None), batches[2])
+
+
+class TestAdaptiveBatchSize(unittest.TestCase):
+
+    def test_clone_keeps_targets(self):
+        (connection, stream) = _connection_to_fake_stream()
+        clone = connection.db.coll.find(target_batch_bytes=1000,
+                                        target_batch_time=0.5).clone()
+        self.assertEqual(1000, clone._Cursor__target_batch_bytes)
+        self.assertEqual(0.5, clone._Cursor__target_batch_time)
+
+    def test_target_bytes(self):
+        (connection, stream) = _connection_to_fake_stream()
+        document = BSON.encode({"x": 1})
+        cursor = connection.db.coll.find(
+            callback=lambda result: None,
+            target_batch_bytes=len(document) * 100)
+        cursor.loop()
+
+        def get_more_limit():
+            # numberToReturn follows the header, a zero and the namespace.
+            return struct.unpack_from("<i", stream.written[-1],
+                                      20 + len("db.coll") + 1)[0]
+
+        stream.reply(struct.unpack_from("<i", stream.written[0], 4)[0],
+                     struct.pack("<iqii", 0, 7, 0, 10) + document * 10)
+        # At most twice as many as last time...
+        self.assertEqual(20, get_more_limit())
+
+        stream.reply(struct.unpack_from("<i", stream.written[1], 4)[0],
+                     struct.pack("<iqii", 0, 7, 10, 20) + document * 20)
+        self.assertEqual(40, get_more_limit())
+
+        # ...and no more than fit the target.
+        big = BSON.encode({"x": 1, "pad": "p" * 100})
+        stream.reply(struct.unpack_from("<i", stream.written[2], 4)[0],
+                     struct.pack("<iqii", 0, 7, 30, 40) + big * 40)
+        self.assertEqual(len(document) * 100 // len(big), get_more_limit())
+
+
+class TestExhaustCursor(unittest.TestCase):
+
+    def test_clone(self):
+        (connection, stream) = _connection_to_fake_stream()
+        clone = connection.db.coll.find(exhaust=True).clone()
+        self.assert_(clone._Cursor__exhaust)
+
+    def test_batches_streamed_on_dedicated_stream(self):
+        (connection, stream) = _connection_to_fake_stream()
+        results = []
+        connection.db.coll.find(callback=results.append, exhaust=True).loop()
+
+        self.assertEqual(1, len(stream.written))
+        (request_id, flags) = struct.unpack_from("<i12xi", stream.written[0],
+                                                 4)
+        self.assertEqual(64, flags & 64)
+        stream.reply(request_id, struct.pack("<iqii", 0, 7, 0, 1) +
+                     BSON.encode({"x": 1}), request_id=10)
+        stream.reply(10, struct.pack("<iqii", 0, 0, 1, 1) +
+                     BSON.encode({"x": 2}), request_id=11)
+
+        # No getMore was sent, and the stream was closed once done.
+        self.assertEqual(1, len(stream.written))
+        self.assertEqual([[{"x": 1}, {"x": 2}]], results)
+        self.assert_(stream.is_closed)
+
+    def test_limit(self):
+        (connection, stream) = _connection_to_fake_stream()
+        results = []
+        connection.db.coll.find(callback=results.append,
+                                exhaust=True).limit(2).loop()
+
+        request_id = struct.unpack_from("<i", stream.written[0], 4)[0]
+        stream.reply(request_id, struct.pack("<iqii", 0, 7, 0, 1) +
+                     BSON.encode({"x": 1}), request_id=10)
+        self.assertEqual([], results)
+        stream.reply(10, struct.pack("<iqii", 0, 7, 1, 1) +
+                     BSON.encode({"x": 2}), request_id=11)
+        # The limit is reached while the server still has more.
+        self.assertEqual([[{"x": 1}, {"x": 2}]], results)
+        self.assertEqual(message.kill_cursors([7])[1][8:],
+                         stream.written[-1][8:])
+
+        # The rest of the stream is dropped.
+        stream.reply(11, struct.pack("<iqii", 0, 0, 2, 1) +
+                     BSON.encode({"x": 3}), request_id=12)
+        self.assertEqual(1, len(results))
+
+    def test_empty_batch(self):
+        (connection, stream) = _connection_to_fake_stream()
+        results = []
+        connection.db.coll.find(callback=results.append, exhaust=True).loop()
+
+        request_id = struct.unpack_from("<i", stream.written[0], 4)[0]
+        stream.reply(request_id, struct.pack("<iqii", 0, 7, 0, 0),
+                     request_id=10)
+        self.assertEqual([[]], results)
+
+
+class TestParallelFind(unittest.TestCase):
+
+    def test_split_points(self):
+        start = datetime.datetime(2010, 1, 1, tzinfo=utc)
+        points = _split_points(ObjectId.from_datetime(start),
+                               ObjectId.from_datetime(
+                                   start + datetime.timedelta(hours=4)), 4)
+        self.assertEqual([start + datetime.timedelta(hours=i)
+                          for i in (1, 2, 3)],
+                         [point.generation_time for point in points])
+        self.assertEqual([25, 50, 75], _split_points(0, 100, 4))
+        self.assertEqual([1], _split_points(0, 2, 4))
+        self.assertEqual([], _split_points(u"a", u"z", 4))
+
+    def test_arguments(self):
+        (connection, stream) = _connection_to_fake_stream()
+        coll = connection.db.coll
+        self.assertRaises(TypeError, coll.parallel_find, {})
+        self.assertRaises(TypeError, coll.parallel_find, {},
+                          callback=lambda batch, more: None, sort=[("a", 1)])
+        self.assertEqual([], stream.written)
+
+        coll.parallel_find({}, callback=lambda batch, more: None,
+                           network_timeout=5)
+        # Both ends are looked up within the timeout.
+        self.assertEqual(2, len(stream.written))
+        self.assertEqual(2, len(stream.io_loop.timeouts))
+        for (deadline, _) in stream.io_loop.timeouts:
+            self.assert_(4 < deadline - time.time() <= 5)
+
+    def test_ranges_scanned_at_once(self):
+        (connection, stream) = _connection_to_fake_stream()
+        # One channel, so that the fake stream's reads line up.
+        connection._Connection__pools[("localhost", 27017)].max_size = 1
+        results = []
+
+        def consume(batch, more):
+            results.append(batch)
+            if more is not None:
+                more()
+
+        connection.db.coll.parallel_find({"a": 1}, callback=consume,
+                                         split_points=[10, 20])
+
+        specs = []
+        for data in stream.written:
+            start = data.index("\x00", 20) + 9
+            size = struct.unpack_from("<i", data, start)[0]
+            specs.append(BSON(data[start:start + size]).decode()["$query"])
+        self.assertEqual([{"a": 1, "_id": {"$lt": 10}},
+                          {"a": 1, "_id": {"$gte": 10, "$lt": 20}},
+                          {"a": 1, "_id": {"$gte": 20}}], specs)
+
+        for (i, data) in enumerate(stream.written):
+            stream.reply(struct.unpack_from("<i", data, 4)[0],
+                         struct.pack("<iqii", 0, 0, 0, 1) +
+                         BSON.encode({"_id": i * 10}))
+        self.assertEqual([[{"_id": 0}], [{"_id": 10}], [{"_id": 20}], None],
+                         results)
+
+
 class TestConnectionAsync(AsyncTestCase):
 
     def test_database_names(self):